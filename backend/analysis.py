@@ -0,0 +1,275 @@
+import json
+import time
+import logging
+from datetime import date
+
+from google import genai
+from google.genai import types
+
+from pydantic import ValidationError
+
+from prompts import FILLIN_PROMPT_TEMPLATE, ANALYZE_PROMPT_TEMPLATE, FIX_PROMPT_TEMPLATE, safety_config
+from partial_json import PartialJSONParser
+from metrics import stage, timed_model_call, record_model_call, validation_events
+from schemas import (
+    FillIn, WoundAnalysis, repair_fillin, repair_analysis, repair_field,
+    failing_paths, partial_model, pick, merge_fix, describe_errors,
+)
+
+log = logging.getLogger("foster.analysis")
+
+FIX_RETRIES = 1   # follow-up calls for fields still invalid after local repair
+
+
+def make_client(api_key, base_url=None):
+    """Gemini client; `base_url` points it at a local stand-in server (see fake_gemini.py)."""
+    http_options = types.HttpOptions(base_url=base_url) if base_url else None
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+
+def is_blocked(response):
+    return not response.candidates
+
+
+def image_part(prepared):
+    # send the preprocessed bytes as-is so the SDK doesn't re-encode a PIL image
+    return types.Part.from_bytes(data=prepared.data, mime_type=prepared.mime_type)
+
+
+def blocked_body(response):
+    return {"status": "blocked", "reason": str(response.prompt_feedback.block_reason)}
+
+
+async def model_call(kind, pool, call_factory, **options):
+    """
+    pool.run() for one generate_content call. Metrics are recorded inside the call
+    factory (once per upstream call, not per coalesced caller); the "model_call"
+    stage covers this request's wait, queueing included.
+    """
+    with stage("model_call"):
+        return await pool.run(lambda: timed_model_call(kind, call_factory(), is_blocked), **options)
+
+
+#---------- VALIDATION ---------------#
+class InvalidModelOutput(ValueError):
+    """The model's answer is still invalid after local repair and the field retries."""
+
+
+def load_json(text):
+    # no text part (e.g. a SAFETY / RECITATION finish) parses like an empty answer: JSONDecodeError
+    return json.loads((text or "").strip().replace("```json", "").replace("```", ""))
+
+
+def validate(schema, doc):
+    """One validation pass: (validated dict, None) or (doc, ValidationError)."""
+    try:
+        return schema.model_validate(doc).model_dump(mode="json"), None
+    except ValidationError as e:
+        return doc, e
+
+
+async def validate_output(kind, schema, repair, text, ask):
+    """
+    Parse + repair + validate a model answer. Fields that still fail are re-requested
+    through `ask(fix_schema, prompt)` (a coroutine returning the response text), at most
+    FIX_RETRIES times, and merged over the original answer.
+    """
+    with stage("parse"):
+        try:
+            doc = load_json(text)
+        except json.JSONDecodeError:
+            doc = {}   # nothing usable: every field counts as failed
+        original = doc if isinstance(doc, dict) else {}
+        repaired = repair(original)
+        doc, error = validate(schema, repaired)
+        if error is None:
+            validation_events.inc(kind=kind, outcome="repaired" if repaired != original else "valid")
+            return doc
+
+    for _ in range(FIX_RETRIES):
+        paths = failing_paths(error)
+        fix_schema = partial_model(schema, paths)
+        log.info("retrying invalid fields", extra={"kind": kind, "fields": [".".join(p) for p in paths]})
+        prompt = FIX_PROMPT_TEMPLATE.format(
+            fields=", ".join(".".join(p) for p in paths),
+            previous=json.dumps(pick(doc, paths), ensure_ascii=False, default=str),
+            errors=describe_errors(error),
+        )
+        fix_text = await ask(fix_schema, prompt)
+        with stage("parse"):
+            try:
+                # the repair functions only touch keys that are present, so they work on a partial answer too
+                fix = fix_schema.model_validate(repair(load_json(fix_text))).model_dump(mode="json")
+            except (json.JSONDecodeError, ValidationError, AttributeError, TypeError):
+                continue
+            doc, error = validate(schema, merge_fix(doc, fix))
+            if error is None:
+                validation_events.inc(kind=kind, outcome="retried")
+                return doc
+
+    validation_events.inc(kind=kind, outcome="invalid")
+    raise InvalidModelOutput(f"{kind} output failed validation: {describe_errors(error)}")
+
+
+def field_fixer(kind, client, model, contents, config, pool, request=None, priority=None):
+    """`ask` for validate_output(): the original request plus the fix prompt, constrained to the fix schema."""
+    async def ask(schema, fix_prompt):
+        response = await model_call(
+            kind, pool,
+            lambda: client.aio.models.generate_content(
+                model=model,
+                contents=[*contents, fix_prompt],
+                config=config(schema),
+            ),
+            request=request,
+            priority=priority,
+        )
+        return (response.text or "") if response.candidates else ""
+    return ask
+
+
+#---------- FILL-IN ---------------#
+def fillin_config(schema=FillIn):
+    return types.GenerateContentConfig(
+        safety_settings=safety_config,
+        temperature=0.2,
+        response_mime_type="application/json",
+        response_schema=schema,
+    )
+
+
+async def run_fillin(client, model, prepared, pool, request=None, priority="fillin", key=None):
+    """
+    Fill-in prompt for one preprocessed image (image_preprocess.PreprocessResult).
+
+    Shared by /analyze-fillin and batch_fillin.py; returns the endpoint's response
+    body ({"status": "success", "analysis": {...}} or {"status": "blocked", ...}).
+    `priority` / `key` go to the pool (scheduler.ModelScheduler: priority class and
+    single-flight key).
+    """
+    contents = [FILLIN_PROMPT_TEMPLATE, image_part(prepared)]
+    response = await model_call(
+        "fillin", pool,
+        lambda: client.aio.models.generate_content(
+            model=model,
+            contents=contents,
+            config=fillin_config(),
+        ),
+        request=request,
+        priority=priority,
+        key=key,
+    )
+    if not response.candidates:
+        return blocked_body(response)
+
+    fields = await validate_output("fillin", FillIn, repair_fillin, response.text,
+                                   field_fixer("fillin_fix", client, model, contents, fillin_config, pool, request, priority))
+    log.debug("fill-in response", extra={"fields": fields})
+    return {"status": "success", "analysis": fields}
+
+
+#---------- WOUND ANALYSIS ---------------#
+def analyze_config(schema=WoundAnalysis):
+    # the static instructions go as the system instruction, ahead of the per-request contents
+    return types.GenerateContentConfig(
+        safety_settings=safety_config,
+        temperature=0.2,
+        response_mime_type="application/json",
+        response_schema=schema,
+        system_instruction=ANALYZE_PROMPT_TEMPLATE,
+    )
+
+
+def analyze_contents(patient_data, prepared):
+    # only the per-request part: the date (task_due is derived from it), the form data and the photo
+    return [f"Today is {date.today()}\n\n===DATA INPUT===\n{patient_data}", image_part(prepared)]
+
+
+async def run_analyze(client, model, patient_data, prepared, pool, request=None, priority="analysis", key=None):
+    contents = analyze_contents(patient_data, prepared)
+    response = await model_call(
+        "analyze", pool,
+        lambda: client.aio.models.generate_content(
+            model=model,
+            contents=contents,
+            config=analyze_config(),
+        ),
+        request=request,
+        priority=priority,
+        key=key,
+    )
+    if not response.candidates:
+        return blocked_body(response)
+
+    log.debug("analysis response", extra={"text": response.text})
+    doc = await validate_output("analyze", WoundAnalysis, repair_analysis, response.text,
+                                field_fixer("analyze_fix", client, model, contents, analyze_config, pool, request, priority))
+    return {"status": "success", "analysis": doc}
+
+
+def validate_analysis(doc):
+    """A cached analysis (dict, or the JSON text older entries hold) as a validated dict; raises InvalidModelOutput."""
+    if isinstance(doc, str):
+        doc = load_json(doc)
+    doc, error = validate(WoundAnalysis, repair_analysis(doc))
+    if error is not None:
+        raise InvalidModelOutput(describe_errors(error))
+    return doc
+
+
+async def stream_analyze(client, model, patient_data, prepared, pool, priority="analysis"):
+    """
+    Streamed wound analysis. Yields ("chunk", text) for every piece the model sends,
+    ("field", (path, value, valid)) as soon as a scalar field of the JSON is complete
+    (value locally repaired; valid=False: it will be re-requested, so "final" may
+    differ), and finally ("final", body) where body["analysis"] is the validated document.
+    """
+    parser = PartialJSONParser()
+    parts = []
+    blocked_reason = None
+    usage = None
+    started = time.perf_counter()
+
+    contents = analyze_contents(patient_data, prepared)
+    stream = pool.stream(
+        lambda: client.aio.models.generate_content_stream(
+            model=model,
+            contents=contents,
+            config=analyze_config(),
+        ),
+        priority=priority,
+    )
+    try:
+        async for chunk in stream:
+            usage = chunk.usage_metadata or usage   # running totals; the last chunk has the final count
+            if not chunk.candidates:
+                if chunk.prompt_feedback and chunk.prompt_feedback.block_reason:
+                    blocked_reason = str(chunk.prompt_feedback.block_reason)
+                continue
+            text = chunk.text or ""
+            if not text:
+                continue
+            parts.append(text)
+            yield "chunk", text
+            for path, value in parser.feed(text):
+                yield "field", (path, *repair_field(WoundAnalysis, repair_analysis, path, value))
+    except Exception as e:
+        record_model_call("analyze_stream", time.perf_counter() - started, "error", error=e)
+        raise
+
+    blocked = blocked_reason is not None and not parts
+    record_model_call("analyze_stream", time.perf_counter() - started, "blocked" if blocked else "success", usage)
+    if blocked:
+        yield "final", {"status": "blocked", "reason": blocked_reason}
+        return
+
+    # field events already went out (repaired, invalid ones flagged); "final" carries the fixed document
+    doc = await validate_output("analyze_stream", WoundAnalysis, repair_analysis, "".join(parts),
+                                field_fixer("analyze_fix", client, model, contents, analyze_config, pool, priority=priority))
+    yield "final", {"status": "success", "analysis": doc}
+
+
+def replay_fields(doc):
+    """Field events (path, value, valid) for an already validated document (used for cache hits)."""
+    events = PartialJSONParser().feed(doc if isinstance(doc, str) else json.dumps(doc, ensure_ascii=False))
+    return [(path, value, True) for path, value in events]
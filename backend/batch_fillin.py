@@ -0,0 +1,183 @@
+"""
+Run the fill-in prompt over a directory of wound images (e.g. ai_engine/data).
+
+    python batch_fillin.py ../ai_engine/data --out fillin_results.ndjson --concurrency 8 --rate 4
+
+Results are appended to the NDJSON file one line per image as they finish, so the
+file doubles as the checkpoint: re-running the same command skips images that
+already have a success/blocked line and retries the ones that errored.
+Use --parquet to also write a Parquet copy at the end (needs pyarrow), and
+--base-url to point at fake_gemini.py instead of the real API.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import datetime
+
+from dotenv import load_dotenv
+
+from analysis import make_client, run_fillin
+from scheduler import ModelScheduler
+from image_preprocess import PreprocessSettings, UnsupportedImageError, preprocess_image
+from image_preprocess import stats as preprocess_stats
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+def list_images(root):
+    found = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                found.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return sorted(found)
+
+
+def load_checkpoint(out_path):
+    """Images that already have a final (success / blocked) line in the output file."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue   # half-written last line of a killed run
+            if row.get("status") in ("success", "blocked"):
+                done.add(row["image"])
+    return done
+
+
+async def process_image(root, rel_path, client, model, pool, settings, retries):
+    started = time.perf_counter()
+    row = {"image": rel_path}
+    with open(os.path.join(root, rel_path), "rb") as f:
+        data = f.read()
+    row["sha256"] = hashlib.sha256(data).hexdigest()
+
+    try:
+        prepared = await asyncio.to_thread(preprocess_image, data, settings)
+    except UnsupportedImageError as e:
+        row.update(status="error", error=str(e))
+        row["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return row
+    row["bytes_before"] = prepared.before_bytes
+    row["bytes_after"] = prepared.after_bytes
+
+    for attempt in range(retries + 1):
+        call_started = time.perf_counter()
+        try:
+            result = await run_fillin(client, model, prepared, pool, priority="batch")
+            row.update(result)
+            row.pop("error", None)
+            break
+        except Exception as e:
+            row.update(status="error", error=f"{type(e).__name__}: {e}")
+            if attempt < retries:
+                await asyncio.sleep(2 ** attempt)
+        finally:
+            row["model_ms"] = round((time.perf_counter() - call_started) * 1000, 1)
+
+    row["attempts"] = attempt + 1
+    row["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return row
+
+
+async def run_batch(args):
+    images = list_images(args.root)
+    done = load_checkpoint(args.out)
+    todo = [p for p in images if p not in done]
+    if args.limit:
+        todo = todo[: args.limit]
+    print(f"{len(images)} images, {len(done)} already done, {len(todo)} to process")
+
+    client = make_client(os.getenv("GEMINI_API_KEY"), base_url=args.base_url or os.getenv("GEMINI_BASE_URL"))
+    # --rate spaces calls 1/rate apart (burst 1); a 429 pauses the whole batch and the call is retried
+    pool = ModelScheduler(max_concurrency=args.concurrency, max_queue=0, timeout_s=args.timeout, rate_per_s=args.rate)
+    settings = PreprocessSettings(max_pixels=args.max_pixels)
+
+    queue = asyncio.Queue()
+    for rel_path in todo:
+        queue.put_nowait(rel_path)
+
+    counts = {"success": 0, "blocked": 0, "error": 0}
+    started = time.perf_counter()
+    out = open(args.out, "a+", encoding="utf-8")
+    if out.tell() > 0:
+        out.seek(out.tell() - 1)
+        if out.read(1) != "\n":
+            out.write("\n")   # a killed run can leave a half-written last line
+
+    async def worker():
+        while True:
+            try:
+                rel_path = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            row = await process_image(args.root, rel_path, client, args.model, pool, settings, args.retries)
+            row["finished_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+            counts[row["status"]] = counts.get(row["status"], 0) + 1
+            finished = sum(counts.values())
+            if finished % 10 == 0 or finished == len(todo):
+                rate = finished / (time.perf_counter() - started)
+                print(f"[{finished}/{len(todo)}] {counts} {rate:.2f} img/s")
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    finally:
+        out.close()
+
+    print(f"done in {time.perf_counter() - started:.1f}s: {counts}")
+    print(f"preprocessing: {preprocess_stats.as_dict()}")
+
+
+def write_parquet(ndjson_path, parquet_path):
+    import pandas as pd
+
+    rows = []
+    with open(ndjson_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            # keep the model output as a JSON string column; its keys vary between rows
+            if "analysis" in row:
+                row["analysis"] = json.dumps(row["analysis"], ensure_ascii=False)
+            rows.append(row)
+    # last line per image wins (a resumed run may have retried earlier errors)
+    df = pd.DataFrame(rows).drop_duplicates(subset="image", keep="last")
+    df.to_parquet(parquet_path, index=False)
+    print(f"wrote {len(df)} rows to {parquet_path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch fill-in analysis over an image directory")
+    parser.add_argument("root", help="directory of wound images, searched recursively")
+    parser.add_argument("--out", default="fillin_results.ndjson", help="NDJSON output / checkpoint file")
+    parser.add_argument("--parquet", help="also write the results to this Parquet file when finished")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=0.0, help="max model calls per second (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-call deadline in seconds")
+    parser.add_argument("--limit", type=int, default=0, help="process at most N new images")
+    parser.add_argument("--model", default="gemini-2.0-flash")
+    parser.add_argument("--max-pixels", type=int, default=PreprocessSettings.max_pixels)
+    parser.add_argument("--base-url", help="Gemini API base URL, e.g. http://127.0.0.1:8001 for fake_gemini.py")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    asyncio.run(run_batch(args))
+    if args.parquet:
+        write_parquet(args.out, args.parquet)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
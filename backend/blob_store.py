@@ -0,0 +1,206 @@
+"""
+Content-addressed storage for uploaded images.
+
+An upload is stored once under the sha256 of its bytes (identical uploads share one
+file) as `<root>/originals/ab/<sha256>` next to a small `<sha256>.json` with its
+type and size. Derivatives (thumbnail / preview JPEGs) are generated on a
+background thread after the upload is stored, or on demand if one is requested
+before that thread gets to it. serve() answers GET/HEAD with ETag / If-None-Match
+and single-range `Range: bytes=...` support, streaming the file in chunks.
+"""
+import io
+import os
+import json
+import hashlib
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+from fastapi.responses import Response, StreamingResponse
+
+from image_preprocess import ACCEPTED_FORMATS, UnsupportedImageError
+
+MIME_TYPES = {"JPEG": "image/jpeg", "MPO": "image/jpeg", "PNG": "image/png"}
+DERIVATIVES = {"thumb": 256, "preview": 1024}   # longest side in px
+DERIVATIVE_QUALITY = 82
+CHUNK_BYTES = 64 * 1024
+
+
+class BlobNotFoundError(KeyError):
+    """No blob (or derivative) with this id."""
+
+
+class BlobStore:
+    def __init__(self, root, derivative_workers=2):
+        self.root = root
+        self._executor = ThreadPoolExecutor(max_workers=derivative_workers, thread_name_prefix="derivatives")
+        self._pending = {}   # blob id -> Future of its derivative job
+        self._lock = threading.Lock()
+        self.stats = {"stored": 0, "deduplicated": 0, "derivatives_built": 0}
+
+    #---------- PATHS ---------------#
+    def _original_path(self, blob_id):
+        if len(blob_id) != 64 or any(c not in "0123456789abcdef" for c in blob_id):
+            raise BlobNotFoundError(blob_id)   # ids come from URLs: only ever plain hex
+        return os.path.join(self.root, "originals", blob_id[:2], blob_id)
+
+    def _derivative_path(self, blob_id, variant):
+        return os.path.join(self.root, "derived", blob_id[:2], f"{blob_id}-{variant}.jpg")
+
+    def exists(self, blob_id):
+        try:
+            return os.path.exists(self._original_path(blob_id) + ".json")
+        except BlobNotFoundError:
+            return False
+
+    def info(self, blob_id):
+        try:
+            with open(self._original_path(blob_id) + ".json", "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise BlobNotFoundError(blob_id)
+
+    #---------- WRITES ---------------#
+    def put(self, data):
+        """Store an uploaded image; returns its blob id (sha256). Raises UnsupportedImageError."""
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                image_format, (width, height) = img.format, img.size
+        except Exception as e:
+            raise UnsupportedImageError(f"cannot decode image: {e}") from e
+        if image_format not in ACCEPTED_FORMATS:
+            raise UnsupportedImageError(f"unsupported image format: {image_format}")
+
+        blob_id = hashlib.sha256(data).hexdigest()
+        path = self._original_path(blob_id)
+        if os.path.exists(path + ".json"):
+            self.stats["deduplicated"] += 1
+            return blob_id
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        info = {
+            "blob_id": blob_id,
+            "mime_type": MIME_TYPES[image_format],
+            "bytes": len(data),
+            "width": width,
+            "height": height,
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        # data first, metadata last: a blob only "exists" once both are complete
+        for target, payload in ((path, data), (path + ".json", json.dumps(info).encode())):
+            tmp_path = f"{target}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, target)
+        self.stats["stored"] += 1
+        self.schedule_derivatives(blob_id)
+        return blob_id
+
+    def schedule_derivatives(self, blob_id):
+        with self._lock:
+            future = self._pending.get(blob_id)
+            submitted = future is None
+            if submitted:
+                future = self._executor.submit(self._build_derivatives, blob_id)
+                self._pending[blob_id] = future
+        if submitted:
+            # outside the lock: on a job that already finished the callback runs right here
+            future.add_done_callback(lambda _: self._forget(blob_id))
+        return future
+
+    def _forget(self, blob_id):
+        with self._lock:
+            self._pending.pop(blob_id, None)
+
+    def _build_derivatives(self, blob_id):
+        if all(os.path.exists(self._derivative_path(blob_id, v)) for v in DERIVATIVES):
+            return
+        with Image.open(self._original_path(blob_id)) as img:
+            img.draft("RGB", (max(DERIVATIVES.values()),) * 2)   # JPEG: decode at reduced scale
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            # largest first, each smaller size resamples the previous one
+            for variant, edge in sorted(DERIVATIVES.items(), key=lambda kv: -kv[1]):
+                img.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+                path = self._derivative_path(blob_id, variant)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                img.save(tmp_path, format="JPEG", quality=DERIVATIVE_QUALITY, optimize=True, progressive=True)
+                os.replace(tmp_path, path)
+        self.stats["derivatives_built"] += 1
+
+    #---------- READS ---------------#
+    def original(self, blob_id):
+        """(path, mime type) of an original."""
+        info = self.info(blob_id)
+        return self._original_path(blob_id), info["mime_type"]
+
+    def derivative(self, blob_id, variant):
+        """(path, mime type) of a derivative, building it now if the background job hasn't yet."""
+        if variant not in DERIVATIVES:
+            raise BlobNotFoundError(f"{blob_id}/{variant}")
+        self.info(blob_id)
+        path = self._derivative_path(blob_id, variant)
+        if not os.path.exists(path):
+            self.schedule_derivatives(blob_id).result()
+        return path, "image/jpeg"
+
+
+#---------- HTTP ---------------#
+def _parse_range(header, size):
+    """(start, end) inclusive for a single `bytes=` range; None if absent or multi-range, ValueError if unsatisfiable."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    if start_text:
+        start = int(start_text)
+        end = min(int(end_text), size - 1) if end_text else size - 1
+    else:   # suffix range: the last N bytes
+        length = int(end_text)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        start, end = max(0, size - length), size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def _iter_file(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_BYTES, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve(request, path, mime_type, etag):
+    """Response for a stored file: 304 on a matching If-None-Match, 206 for a Range, else 200."""
+    size = os.path.getsize(path)
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        # content-addressed: the bytes behind a URL never change
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = _parse_range(request.headers.get("range"), size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    start, end, status = (0, size - 1, 200) if byte_range is None else (*byte_range, 206)
+    length = end - start + 1
+    headers["Content-Length"] = str(length)
+    if status == 206:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    if request.method == "HEAD":
+        return Response(status_code=status, headers=headers, media_type=mime_type)
+    return StreamingResponse(_iter_file(path, start, length), status_code=status, headers=headers, media_type=mime_type)
@@ -0,0 +1,148 @@
+"""
+Mapping of the app's /create-case payload onto wound_cases / ai_analysis /
+treatment_plan / plan_task rows.
+
+    case_data = {
+        "patient_profile": {...}, "selected_patient": {...} | None,
+        "nurse_reviewed": {...fill-in fields...}, "ai_prefill": {...},
+        "ai_analysis": {"AI_analysis": {...}, "treatment_plan": {..., "plan_tasks": [...]}},
+        "urgency": "high_urgent" | "medium" | "routine", "meta": {"sent_at": "..."},
+    }
+"""
+import json
+
+
+# fill-in / form field -> wound_cases column (the table keeps its historic spellings)
+FIELD_COLUMNS = {
+    "size_length_cm": "size_legnth_cm",
+    "discharge_volume": "discharge_volumn",
+}
+CASE_FIELDS = [
+    "temperature", "blood_pressure", "heart_rate", "location_primary", "location_detail",
+    "wound_type", "shape", "size_width_cm", "size_length_cm", "depth_category", "bed_slough_pct",
+    "bed_necrotic_pct", "edge_description", "periwound_status", "discharge_volume",
+    "discharge_type", "odor_presence", "pain_score", "has_infection", "skin_condition",
+]
+
+NEW_CASE_STATUS = "DOCTOR_REVIEW"   # the nurse sends the case after the AI analysis
+URGENT_LEVELS = {"high_urgent", "urgent", "high"}
+
+
+def patient_id_of(case):
+    selected = case.get("selected_patient")
+    if isinstance(selected, dict):
+        return selected.get("patient_id") or selected.get("id")
+    if isinstance(selected, str) and selected:
+        return selected
+    return (case.get("patient_profile") or {}).get("patient_id")
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def red_flags(fields):
+    """Red flags (per the analysis prompt) visible in the fill-in / checklist fields."""
+    flags = []
+    temperature = _number(fields.get("temperature"))
+    if fields.get("has_infection") in (True, "true", 1) and temperature is not None and temperature >= 38.0:
+        flags.append("systemic_infection")
+    if fields.get("depth_category") == "very_deep_exposed_bone_tendon":
+        flags.append("exposed_bone_tendon")
+    if str(fields.get("discharge_type") or "").startswith("purulent"):
+        flags.append("purulent_discharge")
+    if fields.get("odor_presence") in ("foul", "putrid"):
+        flags.append("foul_odor")
+    if fields.get("periwound_status") == "fluctuant":
+        flags.append("fluctuant_periwound")
+    necrotic = _number(fields.get("bed_necrotic_pct"))
+    if necrotic is not None and necrotic >= 50:
+        flags.append("necrosis")
+    return flags
+
+
+def analysis_priority(patient_data, stored_urgency=None):
+    """
+    Scheduler class of an /analyze-wound request: "urgent" when the case is marked
+    high urgency (in the payload, or `stored_urgency` = the patient's latest
+    wound_cases.urgentcy) or the checklist shows a red flag, else "analysis".
+    """
+    try:
+        payload = json.loads(patient_data) if isinstance(patient_data, str) else patient_data
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        return "urgent" if stored_urgency in URGENT_LEVELS else "analysis"
+    selected = payload.get("selected_patient") if isinstance(payload.get("selected_patient"), dict) else {}
+    urgency = payload.get("urgency") or selected.get("urgency") or stored_urgency
+    fields = {**payload, **(payload.get("nurse_reviewed") or {})}
+    return "urgent" if urgency in URGENT_LEVELS or red_flags(fields) else "analysis"
+
+
+def _value(value):
+    # sqlite3 only takes scalars; bools go in as 0/1 like the CSV import
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def case_rows(case, model_version, now, created_by="nurse", image_id=None):
+    """(record, analysis, plan, tasks) rows for Store.create_case; analysis / plan may be None."""
+    fields = {**(case.get("ai_prefill") or {}), **(case.get("nurse_reviewed") or {})}
+    record = {
+        "patient_id": patient_id_of(case),
+        "created_by_nurse": created_by,
+        "status": NEW_CASE_STATUS,
+        "urgentcy": case.get("urgency"),
+        "created_at": (case.get("meta") or {}).get("sent_at") or now,
+        "analyze_at": now,
+        "doctor_review_at": now,
+        "latest_image_id": image_id,
+        "record_create_at": now,
+        "updated_at": now,
+    }
+    for field in CASE_FIELDS:
+        if fields.get(field) not in (None, ""):
+            record[FIELD_COLUMNS.get(field, field)] = _value(fields[field])
+
+    doc = case.get("ai_analysis") or {}
+    if isinstance(doc, str):
+        doc = json.loads(doc)
+
+    analysis = None
+    ai = doc.get("AI_analysis")
+    if isinstance(ai, dict):
+        analysis = {
+            "creator": ai.get("creator") or "Gemini AI",
+            "wound_stage": ai.get("wound_stage"),
+            "description": ai.get("description"),
+            "diagnosis": ai.get("diagnosis"),
+            "treatment_plan": _value(ai.get("treatment_plan")),
+            "confidence": ai.get("confidence"),
+            "images_list": image_id,
+            "model_version": model_version,
+            "created_at": now,
+        }
+
+    plan, tasks = None, []
+    tp = doc.get("treatment_plan")
+    if isinstance(tp, dict):
+        plan = {
+            "plan_text": _value(tp.get("plan_text")),
+            "version": 1,
+            "active_flag": 1,
+            "followup_days": tp.get("followup_days"),
+            "status": tp.get("status") or "DRAFT",
+            "updated_at": now,
+        }
+        tasks = [
+            {"task_text": t.get("task_text"), "status": t.get("status") or "DRAFT", "task_due": t.get("task_due")}
+            for t in tp.get("plan_tasks") or []
+            if isinstance(t, dict)
+        ]
+    return record, analysis, plan, tasks
@@ -0,0 +1,159 @@
+"""
+Case inbox aggregates, kept up to date from Store writes instead of rescanning tables.
+
+Dashboard.load(store) reads the tables at startup; after that every committed write
+transaction of this process reaches on_commit() (it is registered as a Store
+listener) and adjusts the counters in O(1). snapshot() builds the response body only
+when something changed, or when the next open task becomes overdue, and hands out an
+ETag for it.
+
+The aggregates live in the process, so before every snapshot the Store's write
+version (shared through the database file) is compared with the version they
+reflect: when another uvicorn worker has written in between, the tables are read
+again. Every worker therefore serves the same counts and ETags.
+"""
+import json
+import hashlib
+import datetime
+import threading
+from collections import Counter, deque
+
+
+DONE_TASK_STATUSES = {"DONE", "COMPLETED", "CANCELLED"}
+TABLES = ("wound_cases", "plan_task", "ai_analysis")
+TIMESTAMP_FORMATS = ["%y/%m/%d %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]
+
+
+def parse_timestamp(value):
+    """Local naive datetime from the formats found in the tables / model output; None if unparseable."""
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        parsed = None
+        for fmt in TIMESTAMP_FORMATS:
+            try:
+                parsed = datetime.datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+    if parsed is not None and parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def _is_open(task):
+    return (task.get("status") or "").upper() not in DONE_TASK_STATUSES and not task.get("done_time")
+
+
+class Dashboard:
+    def __init__(self, recent_limit=20, overdue_limit=50):
+        self.recent_limit = recent_limit
+        self.overdue_limit = overdue_limit
+        self._lock = threading.Lock()
+        self._store = None
+        self._store_version = None    # Store.version() the aggregates reflect
+        self._version = 0
+        self._cached = None           # (version, valid_until, etag, body)
+        self._reset()
+
+    def _reset(self):
+        self._cases = {}              # record_id -> (status, urgency) of its latest row
+        self._status = Counter()
+        self._urgency = Counter()
+        self._open_tasks = {}         # task_id -> (due datetime | None, row)
+        self._recent = deque(maxlen=self.recent_limit)
+
+    #---------- WRITES ---------------#
+    def load(self, store):
+        """(Re)build the aggregates from the tables."""
+        self._store = store
+        version, tables = store.read_tables(TABLES)
+        with self._lock:
+            if self._store_version is not None and version <= self._store_version:
+                return   # another thread got there first
+            self._reset()
+            for table in TABLES:
+                for row in tables[table]:
+                    self._apply(table, row)
+            self._store_version = version
+            self._version += 1
+
+    def on_commit(self, version, writes):
+        with self._lock:
+            if self._store_version is None or version != self._store_version + 1:
+                # already part of a reload, or another process wrote in between: snapshot() reloads
+                return
+            for table, row, _ in writes:
+                self._apply(table, row)
+            self._store_version = version
+            self._version += 1
+
+    def _apply(self, table, row):
+        if table == "wound_cases":
+            self._case_written(row)
+        elif table == "plan_task":
+            self._task_written(row)
+        elif table == "ai_analysis":
+            self._recent.appendleft({
+                k: row.get(k)
+                for k in ("analysis_id", "record_id", "wound_stage", "diagnosis", "confidence", "created_at")
+            })
+
+    def _case_written(self, row):
+        record_id = row.get("record_id")
+        state = (row.get("status") or "UNKNOWN", row.get("urgentcy") or "unset")
+        previous = self._cases.get(record_id)
+        if previous is not None:
+            self._status[previous[0]] -= 1
+            self._urgency[previous[1]] -= 1
+        self._cases[record_id] = state
+        self._status[state[0]] += 1
+        self._urgency[state[1]] += 1
+
+    def _task_written(self, row):
+        task_id = row.get("task_id")
+        if _is_open(row):
+            self._open_tasks[task_id] = (parse_timestamp(row.get("task_due")), row)
+        else:
+            self._open_tasks.pop(task_id, None)
+
+    #---------- READS ---------------#
+    def snapshot(self, now=None):
+        """(etag, body) of the current dashboard."""
+        now = now or datetime.datetime.now()
+        if self._store is not None and self._store.version() != self._store_version:
+            self.load(self._store)
+        with self._lock:
+            cached = self._cached
+            if cached is not None and cached[0] == self._version and (cached[1] is None or now < cached[1]):
+                return cached[2], cached[3]
+
+            overdue = []
+            next_due = None   # the body stays valid until this open task becomes overdue
+            for due, task in self._open_tasks.values():
+                if due is None:
+                    continue
+                if due <= now:
+                    overdue.append((due, task))
+                elif next_due is None or due < next_due:
+                    next_due = due
+            overdue.sort(key=lambda item: item[0])
+
+            body = {
+                "cases": len(self._cases),
+                "by_status": {k: v for k, v in self._status.items() if v > 0},
+                "by_urgency": {k: v for k, v in self._urgency.items() if v > 0},
+                "open_tasks": len(self._open_tasks),
+                "overdue_tasks": len(overdue),
+                "overdue": [
+                    {k: task.get(k) for k in ("task_id", "plan_id", "task_text", "status", "task_due")}
+                    for _, task in overdue[: self.overdue_limit]
+                ],
+                "recent_analyses": list(self._recent),
+            }
+            etag = '"' + hashlib.sha1(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()[:20] + '"'
+            self._cached = (self._version, next_due, etag, body)
+            return etag, body
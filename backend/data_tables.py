@@ -0,0 +1,194 @@
+"""
+Typed, lazily loaded access to the mockup_data tables.
+
+Each table has an explicit schema (column -> pandas dtype). Loading keeps only the
+schema columns (the CSVs carry dozens of empty trailing columns), drops blank rows
+and applies the dtypes. When pyarrow is installed a Parquet copy is written to the
+cache directory and reused until the source CSV changes.
+
+    python data_tables.py [data_root]    # measure CSV vs cached load time and memory
+"""
+import os
+import sys
+import json
+import time
+import threading
+import importlib.util
+
+import pandas as pd
+
+# optional dependency (see requirements.txt): without it tables are always parsed from CSV
+HAS_PARQUET = importlib.util.find_spec("pyarrow") is not None
+
+
+DEFAULT_DATA_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mockup_data")
+
+# Low-cardinality text columns are categories; ids, names and timestamps stay strings
+# (timestamps come in mixed formats, e.g. "26/01/28 11:33" and "2026-01-28 15:49:08").
+TABLE_SCHEMAS = {
+    "patients": {
+        "patient_id": "string", "patient_name": "string", "phone_no": "string", "dob": "string",
+        "gender": "category", "height_cm": "Float64", "weight_kg": "Float64", "status": "category",
+        "occupation": "string", "medical_history": "string", "image_url": "string",
+        "created_by": "category", "created_at": "string",
+    },
+    "wound_cases": {
+        "record_id": "string", "case_id": "string", "patient_id": "string",
+        "created_by_nurse": "category", "assigned_doctor": "category", "status": "category",
+        "urgentcy": "category", "created_at": "string", "analyze_at": "string",
+        "doctor_review_at": "string", "plan_issued_at": "string", "treatment_active_at": "string",
+        "appointment_set_at": "string", "completed_at": "string", "latest_image_id": "string",
+        "temperature": "Float64", "blood_pressure": "Float64", "heart_rate": "Float64",
+        "location_primary": "category", "location_detail": "string", "wound_type": "category",
+        "shape": "category", "size_width_cm": "Float64", "size_legnth_cm": "Float64",
+        "depth_category": "category", "bed_slough_pct": "Float64", "bed_necrotic_pct": "Float64",
+        "edge_description": "category", "periwound_status": "category", "discharge_volumn": "category",
+        "discharge_type": "category", "odor_presence": "category", "pain_score": "Float64",
+        "has_infection": "boolean", "skin_condition": "category", "record_create_at": "string",
+        "updated_at": "string",
+    },
+    "ai_analysis": {
+        "analysis_id": "string", "creator": "category", "record_id": "string", "wound_stage": "category",
+        "description": "string", "diagnosis": "string", "treatment_plan": "string",
+        "healing_progress": "string", "confidence": "Float64", "images_list": "string",
+        "model_version": "category", "created_at": "string",
+    },
+    "treatment_plan": {
+        "plan_id": "string", "case_id": "string", "doctor_id": "string", "plan_text": "string",
+        "version": "Float64", "active_flag": "boolean", "followup_days": "Float64",
+        "status": "category", "updated_at": "string",
+    },
+    "plan_task": {
+        "task_id": "string", "plan_id": "string", "task_text": "string", "status": "category",
+        "task_due": "string", "done_time": "string", "done_by": "string",
+    },
+}
+
+BOOL_VALUES = {"true": True, "false": False, "1": True, "0": False, "yes": True, "no": False}
+
+
+def _source_signature(path):
+    st = os.stat(path)
+    return {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+
+def read_table_csv(table, path):
+    """Parse one mockup CSV into its typed schema."""
+    schema = TABLE_SCHEMAS[table]
+    df = pd.read_csv(
+        path,
+        encoding="utf-8-sig",                         # the exports start with a BOM
+        dtype=str,
+        keep_default_na=False,
+        usecols=lambda c: c.strip() in schema,        # skips the empty trailing columns
+    )
+    df.columns = [c.strip() for c in df.columns]      # e.g. "doctor_id " in treatment_plan.csv
+    df = df.replace("", pd.NA)
+    df = df.dropna(how="all").reset_index(drop=True)
+
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            df[column] = pd.Series(pd.NA, index=df.index, dtype="object")
+        if dtype == "boolean":
+            df[column] = df[column].str.strip().str.lower().map(BOOL_VALUES).astype("boolean")
+        elif dtype == "Float64":
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype("Float64")
+        else:
+            df[column] = df[column].astype(dtype)
+    return df[list(schema)]
+
+
+class DataTables:
+    """
+    Lazily loaded tables from `data_root`. Nothing is read until get() is called;
+    a table is re-read only when its CSV changes.
+    """
+
+    def __init__(self, data_root=None, cache_dir=None):
+        self.data_root = data_root or DEFAULT_DATA_ROOT
+        self.cache_dir = cache_dir
+        self._frames = {}       # table -> (signature, DataFrame)
+        self._lock = threading.Lock()
+        self.stats = {}         # table -> {"source", "seconds", "rows", "memory_bytes"}
+
+    def path(self, table):
+        return os.path.join(self.data_root, f"{table}.csv")
+
+    def exists(self, table):
+        return os.path.exists(self.path(table))
+
+    def get(self, table):
+        if table not in TABLE_SCHEMAS:
+            raise KeyError(f"unknown table: {table}")
+        signature = _source_signature(self.path(table))
+        loaded = self._frames.get(table)
+        if loaded is not None and loaded[0] == signature:
+            return loaded[1]
+
+        with self._lock:
+            loaded = self._frames.get(table)
+            if loaded is not None and loaded[0] == signature:
+                return loaded[1]
+            started = time.perf_counter()
+            df, source = self._load(table, signature)
+            self._frames[table] = (signature, df)
+            self.stats[table] = {
+                "source": source,
+                "seconds": round(time.perf_counter() - started, 4),
+                "rows": len(df),
+                "memory_bytes": int(df.memory_usage(deep=True).sum()),
+            }
+            return df
+
+    #---------- PARQUET CACHE ---------------#
+    def _cache_paths(self, table):
+        base = os.path.join(self.cache_dir, "tables", table)
+        return f"{base}.parquet", f"{base}.meta.json"
+
+    def _load(self, table, signature):
+        if not (self.cache_dir and HAS_PARQUET):
+            return read_table_csv(table, self.path(table)), "csv"
+
+        parquet_path, meta_path = self._cache_paths(table)
+        expected = {**signature, "schema": TABLE_SCHEMAS[table]}
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                if json.load(f) == expected:
+                    return pd.read_parquet(parquet_path), "parquet"
+        except (FileNotFoundError, ValueError, OSError):
+            pass
+
+        df = read_table_csv(table, self.path(table))
+        os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+        df.to_parquet(parquet_path, index=False)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(expected, f)
+        return df, "csv"
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    root = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATA_ROOT
+    print(f"data root: {root} (parquet cache {'available' if HAS_PARQUET else 'unavailable, install pyarrow'})")
+    print(f"{'table':<16}{'rows':>6}{'untyped ms':>12}{'untyped KB':>12}{'typed ms':>10}{'typed KB':>10}{'cached ms':>11}")
+    cache_dir = tempfile.mkdtemp()
+    DataTables(root, cache_dir=cache_dir)   # warm-up import of pandas internals
+    for table in TABLE_SCHEMAS:
+        path = os.path.join(root, f"{table}.csv")
+        if not os.path.exists(path):
+            continue
+        started = time.perf_counter()
+        raw = pd.read_csv(path)   # what main.py used to do at import time
+        raw_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        typed = read_table_csv(table, path)
+        typed_ms = (time.perf_counter() - started) * 1000
+        cached_ms = float("nan")
+        if HAS_PARQUET:
+            DataTables(root, cache_dir=cache_dir).get(table)           # builds the Parquet copy
+            cold = DataTables(root, cache_dir=cache_dir)
+            cold.get(table)
+            cached_ms = cold.stats[table]["seconds"] * 1000
+        print(f"{table:<16}{len(typed):>6}{raw_ms:>12.1f}{raw.memory_usage(deep=True).sum() / 1024:>12.1f}"
+              f"{typed_ms:>10.1f}{typed.memory_usage(deep=True).sum() / 1024:>10.1f}{cached_ms:>11.1f}")
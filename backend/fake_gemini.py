@@ -0,0 +1,221 @@
+"""
+Local stand-in for the Gemini generateContent API, for batch runs and load tests
+without network or quota.
+
+    python fake_gemini.py --port 8001 --latency-ms 800 --jitter-ms 400 --error-rate 0.02
+    GEMINI_BASE_URL=http://127.0.0.1:8001 GEMINI_API_KEY=fake uvicorn main:app
+
+Answers are deterministic per request body, so repeated runs are comparable; latency
+jitter and injected errors (429 / 503 in the API's error format) come from --seed.
+With --input-ms-per-1k-tokens the latency grows with the input size (prompt text,
+system instruction and images), so prompt size shows up in load tests. --malformed-rate
+makes a fraction of the answers use near-miss values ("Stage 3",
+confidence 85, "Full thickness") to exercise the repair / retry path.
+"""
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse, JSONResponse
+
+
+FILLIN_CHOICES = {
+    "location_primary": ["toe", "sole", "side", "heel", "dorsal_aspect", "medial_malleolus", "lateral_malleolus"],
+    "shape": ["round", "oval", "irregular", "linear", "punched_out"],
+    "depth_category": ["superficial", "partial_thickness", "full_thickness", "deep", "very_deep_exposed_bone_tendon"],
+    "edge_description": ["smooth", "thickened", "irregular", "rolled_epibole", "undermined", "calloused"],
+    "periwound_status": ["normal", "erythematous", "edematous", "indurated", "macerated", "fluctuant", "hyperpigmented"],
+    "discharge_volume": ["none", "minimal", "moderate", "heavy"],
+    "discharge_type": ["serous (clear)", "sanguineous (bloody)", "serosanguineous (pink)", "purulent (yellow/pus)", "seropurulent (cloudy yellow)"],
+    "odor_presence": ["none", "faint", "moderate", "foul", "putrid"],
+    "skin_condition": ["healthy", "dry", "cracked", "macerated", "fragile", "scaling"],
+}
+
+
+def fake_fillin(rng):
+    doc = {k: rng.choice(v) for k, v in FILLIN_CHOICES.items()}
+    doc.update({
+        "location_detail": "plantar aspect, estimated",
+        "wound_type": "Diabetic foot ulcer",
+        "size_width_cm": round(rng.uniform(0.5, 6.0), 1),
+        "size_length_cm": round(rng.uniform(0.5, 8.0), 1),
+        "bed_slough_pct": rng.randrange(0, 80, 5),
+        "bed_necrotic_pct": rng.randrange(0, 40, 5),
+        "pain_score": rng.randint(0, 10),
+        "has_infection": rng.random() < 0.3,
+    })
+    return doc
+
+
+def fake_analysis(rng):
+    stage = rng.randint(1, 6)
+    followup = rng.choice([1, 2, 3, 7, 14])
+    return {
+        "AI_analysis": {
+            "creator": "Gemini AI",
+            "wound_stage": f"STAGE {stage}",
+            "description": "1. Patient & Clinical Overview: stand-in response. 2. Formal Wound Description: ... "
+                           "This is an AI-generated draft for clinical documentation support only.",
+            "diagnosis": "Diabetic foot ulcer at plantar forefoot, partial thickness, without signs of infection.",
+            "confidence": round(rng.uniform(0.3, 0.9), 2),
+            "treatment_plan": "Offloading, moisture balance, reassess in follow-up. This is an AI-generated draft.",
+        },
+        "treatment_plan": {
+            "plan_text": "Clean and dress wound, offload, monitor for infection signs.",
+            "followup_days": followup,
+            "status": "DRAFT",
+            "plan_tasks": [
+                {"task_text": f"Task {i + 1}: reassess wound", "status": "DRAFT", "task_due": f"2026-01-{28 + min(i, 3):02d}T10:00:00+07:00"}
+                for i in range(rng.randint(3, 6))
+            ],
+        },
+    }
+
+
+FILLER = (" Periwound skin should be reassessed at every dressing change and any increase in"
+          " erythema, warmth, exudate or pain documented and escalated.")
+
+ERRORS = [
+    (429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota)."),
+    (503, "UNAVAILABLE", "The model is overloaded. Please try again later."),
+]
+
+
+def malform(doc, rng):
+    """Near-miss values a real model produces now and then; one in three is beyond local repair."""
+    if "AI_analysis" in doc:
+        doc["AI_analysis"]["confidence"] = round(doc["AI_analysis"]["confidence"] * 100)
+        doc["AI_analysis"]["wound_stage"] = doc["AI_analysis"]["wound_stage"].title()
+        for task in doc["treatment_plan"]["plan_tasks"]:
+            task["task_due"] = task["task_due"][:16].replace("T", " ")
+        if rng.random() < 1 / 3:
+            doc["AI_analysis"]["wound_stage"] = "Wagner 2"
+    else:
+        doc["depth_category"] = doc["depth_category"].replace("_", " ").capitalize()
+        doc["pain_score"] = f"{doc['pain_score']}/10"
+        if rng.random() < 1 / 3:
+            doc["shape"] = "star-shaped"
+    return doc
+
+
+def pad_document(doc, min_chars):
+    """Grow the free-text field until the JSON text is at least min_chars long."""
+    target = doc["AI_analysis"] if "AI_analysis" in doc else doc
+    key = "description" if "AI_analysis" in doc else "location_detail"
+    missing = min_chars - len(json.dumps(doc, ensure_ascii=False))
+    if missing > 0:
+        target[key] += (FILLER * (missing // len(FILLER) + 1))[:missing]
+    return doc
+
+
+def error_body(code, status, message):
+    body = {"error": {"code": code, "message": message, "status": status}}
+    if code == 429:   # like the real API: how long to back off
+        body["error"]["details"] = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "1s"}]
+    return body
+
+
+def response_body(text, prompt_tokens, model):
+    candidate_tokens = len(text) // 4
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": candidate_tokens,
+            "totalTokenCount": prompt_tokens + candidate_tokens,
+        },
+        "modelVersion": model,
+    }
+
+
+def text_of(content):
+    """Text parts of a Content dict (or a list of them)."""
+    contents = content if isinstance(content, list) else [content] if content else []
+    return " ".join(part.get("text", "") for c in contents for part in c.get("parts", []))
+
+
+def text_tokens(text):
+    return len(text) // 4   # ~4 chars per token
+
+
+def build_app(latency_ms=0.0, chunk_delay_ms=0.0, chunk_chars=64, jitter_ms=0.0, error_rate=0.0,
+              response_chars=0, malformed_rate=0.0, input_ms_per_1k_tokens=0.0, seed=0):
+    app = FastAPI(title="Fake Gemini")
+    noise = random.Random(seed)   # jitter / errors; separate from the per-body answer rng
+
+    @app.post("/{version}/models/{model_action}")
+    async def generate_content(version: str, model_action: str, request: Request):
+        body = await request.body()
+        payload = json.loads(body or b"{}")
+        rng = random.Random(hashlib.sha256(body).hexdigest())
+
+        prompt = text_of(payload.get("contents", []))
+        instruction = text_of(payload.get("systemInstruction"))
+        doc = fake_analysis(rng) if "AI_analysis" in prompt + instruction else fake_fillin(rng)
+        # follow-up requests for invalid fields (analysis.validate_output) are always answered cleanly
+        if malformed_rate and "Previous values:" not in prompt and rng.random() < malformed_rate:
+            doc = malform(doc, rng)
+        if response_chars:
+            doc = pad_document(doc, response_chars)
+
+        text = json.dumps(doc, ensure_ascii=False)
+        prompt_tokens = text_tokens(prompt) + text_tokens(instruction) + 258   # 258 per image
+        model = model_action.split(":")[0]
+        # reading the input costs time per token
+        input_ms = input_ms_per_1k_tokens * prompt_tokens / 1000
+        delay_s = (latency_ms + input_ms + noise.uniform(0, jitter_ms)) / 1000
+
+        if error_rate and noise.random() < error_rate:
+            code, status, message = noise.choice(ERRORS)
+            await asyncio.sleep(delay_s / 4)   # errors come back faster than answers
+            return JSONResponse(status_code=code, content=error_body(code, status, message))
+
+        if model_action.endswith(":streamGenerateContent"):
+            async def sse():
+                # latency_ms (+ jitter) is the time to first token, then one chunk every chunk_delay_ms
+                if delay_s:
+                    await asyncio.sleep(delay_s)
+                for i in range(0, len(text), chunk_chars):
+                    if i and chunk_delay_ms:
+                        await asyncio.sleep(chunk_delay_ms / 1000)
+                    chunk = response_body(text[i:i + chunk_chars], prompt_tokens, model)
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n"
+            return StreamingResponse(sse(), media_type="text/event-stream")
+
+        if delay_s:
+            await asyncio.sleep(delay_s)
+        return response_body(text, prompt_tokens, model)
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the Gemini API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay before the (first chunk of the) response")
+    parser.add_argument("--chunk-delay-ms", type=float, default=0.0, help="delay between streamed chunks")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="extra uniform random delay, 0..jitter")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 429/503")
+    parser.add_argument("--response-chars", type=int, default=0, help="pad answers to at least this many characters")
+    parser.add_argument("--input-ms-per-1k-tokens", type=float, default=0.0,
+                        help="extra latency per 1000 input tokens")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of answers with out-of-schema values")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    app = build_app(
+        latency_ms=args.latency_ms,
+        chunk_delay_ms=args.chunk_delay_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        response_chars=args.response_chars,
+        malformed_rate=args.malformed_rate,
+        input_ms_per_1k_tokens=args.input_ms_per_1k_tokens,
+        seed=args.seed,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,201 @@
+import io
+import math
+import hashlib
+import threading
+from dataclasses import dataclass, field
+
+from PIL import Image, ImageOps
+
+
+# PIL names for what the app accepts; MPO is what many phones write for "JPEG"
+ACCEPTED_FORMATS = {"JPEG", "PNG", "MPO"}
+OUTPUT_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png"}
+
+
+#---------- ERRORS ---------------#
+class UnsupportedImageError(ValueError):
+    """The upload is not a PNG/JPG/JPEG image we can decode."""
+
+
+#---------- SETTINGS / RESULT ---------------#
+@dataclass(frozen=True)
+class PreprocessSettings:
+    max_pixels: int = 2_000_000       # width * height budget; larger images are downscaled
+    output_format: str = "JPEG"       # JPEG or PNG
+    jpeg_quality: int = 85
+    max_upload_bytes: int = 15 * 1024 * 1024
+
+    @property
+    def signature(self):
+        # goes into response cache keys: a different pipeline means a different model input
+        return f"{self.max_pixels}:{self.output_format}:{self.jpeg_quality}"
+
+
+@dataclass
+class PreprocessResult:
+    image: Image.Image
+    data: bytes
+    mime_type: str
+    before_bytes: int
+    after_bytes: int
+    before_size: tuple
+    after_size: tuple
+
+    @property
+    def sha256(self):
+        return hashlib.sha256(self.data).hexdigest()
+
+
+@dataclass
+class PreprocessStats:
+    images: int = 0
+    before_bytes: int = 0
+    after_bytes: int = 0
+    downscaled: int = 0
+    passthrough: int = 0
+    by_format: dict = field(default_factory=dict)
+    # preprocess_image runs in asyncio.to_thread workers: updates and reads take the lock
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def record(self, result, source_format):
+        with self._lock:
+            self.images += 1
+            self.before_bytes += result.before_bytes
+            self.after_bytes += result.after_bytes
+            if result.after_size != result.before_size:
+                self.downscaled += 1
+            if result.after_bytes == result.before_bytes:
+                self.passthrough += 1
+            self.by_format[source_format] = self.by_format.get(source_format, 0) + 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "images": self.images,
+                "before_bytes": self.before_bytes,
+                "after_bytes": self.after_bytes,
+                "saved_pct": round(100 * (1 - self.after_bytes / self.before_bytes), 1) if self.before_bytes else 0.0,
+                "downscaled": self.downscaled,
+                "passthrough": self.passthrough,
+                "by_format": dict(self.by_format),
+            }
+
+
+stats = PreprocessStats()
+
+
+#---------- PIPELINE ---------------#
+def preprocess_image(data, settings=PreprocessSettings()):
+    """
+    Normalize one uploaded photo before it is sent to the model:
+    EXIF orientation fix -> downscale to the pixel budget -> re-encode as
+    `settings.output_format`. An upload that is already upright, within budget and
+    in the output format is passed through untouched.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        source_format = img.format
+    except Exception as e:
+        raise UnsupportedImageError(f"cannot decode image: {e}") from e
+    if source_format not in ACCEPTED_FORMATS:
+        raise UnsupportedImageError(f"unsupported image format: {source_format}")
+
+    before_size = img.size
+    target_format = settings.output_format.upper()
+    over_budget = img.width * img.height > settings.max_pixels
+    upright = img.getexif().get(0x0112, 1) == 1
+
+    if not over_budget and upright and normalize_format(source_format) == target_format:
+        result = PreprocessResult(img, data, OUTPUT_MIME_TYPES[target_format], len(data), len(data), before_size, before_size)
+        stats.record(result, source_format)
+        return result
+
+    if over_budget and source_format in ("JPEG", "MPO"):
+        # JPEG draft mode lets libjpeg decode straight at 1/2, 1/4 or 1/8 scale,
+        # which is much cheaper than decoding a 12MP photo and resizing it
+        scale = math.sqrt(settings.max_pixels / (img.width * img.height))
+        img.draft("RGB", (int(img.width * scale), int(img.height * scale)))
+
+    img = ImageOps.exif_transpose(img)
+    if img.width * img.height > settings.max_pixels:
+        scale = math.sqrt(settings.max_pixels / (img.width * img.height))
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS)
+
+    out = io.BytesIO()
+    if target_format == "JPEG":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(out, format="JPEG", quality=settings.jpeg_quality, optimize=True)
+    else:
+        img.save(out, format="PNG", optimize=True)
+    encoded = out.getvalue()
+
+    result = PreprocessResult(img, encoded, OUTPUT_MIME_TYPES[target_format], len(data), len(encoded), before_size, img.size)
+    stats.record(result, source_format)
+    return result
+
+
+def normalize_format(name):
+    """Map the various spellings (jpg, jpeg, MPO, png) onto JPEG / PNG."""
+    name = (name or "").upper()
+    if name in ("JPG", "JPEG", "MPO"):
+        return "JPEG"
+    return name
+
+
+#---------- UPLOAD SIZE LIMIT ---------------#
+class MaxUploadSizeMiddleware:
+    """
+    ASGI middleware that rejects request bodies over `max_bytes` with 413.
+
+    The declared Content-Length is checked up front; chunked or lying clients are
+    caught while the body streams in, before the whole thing is spooled to disk.
+    """
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def _reject(self, send):
+        body = b'{"detail":"upload too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return await self.app(scope, receive, send)
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_bytes:
+            return await self._reject(send)
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    # pretend the client hung up so the form parser stops reading
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            # once over the limit the app only produces a parse error; answer 413 instead
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded:
+            await self._reject(send)
@@ -0,0 +1,344 @@
+"""
+Load test for the backend endpoints, against fake_gemini.py or a running server.
+
+    # start fake_gemini.py + uvicorn main:app on temporary data, then run the load
+    python loadtest.py --spawn --fake-latency-ms 800 --fake-jitter-ms 400 --concurrency 1,4,16
+
+    # or against a server you started yourself
+    python loadtest.py --target http://127.0.0.1:8000 --endpoints analyze-fillin --requests 200
+
+    # compare two result files
+    python loadtest.py --compare results/a.json results/b.json
+
+    # A/B a backend setting (here: the model-call concurrency limit)
+    python loadtest.py --spawn --endpoints analyze-wound --backend-env GEMINI_MAX_CONCURRENCY=4 --label c4
+    python loadtest.py --spawn --endpoints analyze-wound --backend-env GEMINI_MAX_CONCURRENCY=16 --label c16
+
+Each endpoint is driven at every concurrency level with images sampled from
+ai_engine/data. Per endpoint and level, the results JSON holds throughput and
+p50/p95/p99 latency, plus model calls and prompt / cached tokens per call when the
+target serves /metrics. Every upload gets random trailing bytes (decoders ignore
+them), so the response cache filled by one level cannot answer the next and each
+level measures model calls; --no-unique-images sends the sampled images as they
+are, to measure the cache instead.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import datetime
+import tempfile
+import subprocess
+
+import httpx
+import numpy as np
+
+from fake_gemini import fake_analysis, fake_fillin
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_IMAGES = os.path.join(os.path.dirname(BACKEND_DIR), "ai_engine", "data")
+ENDPOINTS = ["create-patient-profile", "analyze-fillin", "analyze-wound", "create-case"]
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+MIME_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+
+
+#---------- PAYLOADS ---------------#
+def load_images(root, limit, rng):
+    paths = sorted(
+        os.path.join(dirpath, name)
+        for dirpath, _, names in os.walk(root)
+        for name in names
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+    )
+    if not paths:
+        raise SystemExit(f"no images under {root}")
+    rng.shuffle(paths)
+    images = []
+    for path in paths[:limit]:
+        with open(path, "rb") as f:
+            images.append((os.path.basename(path), f.read(), MIME_TYPES[os.path.splitext(path)[1].lower()]))
+    return images
+
+
+def patient_data(i):
+    return {
+        "patient_name": f"Load Test {i}", "phone_no": "0800000000", "dob": "1958-04-02", "gender": "male",
+        "height_cm": 170, "weight_kg": 72, "occupation": "farmer", "medical_history": "T2DM, hypertension",
+    }
+
+
+def build_request(endpoint, i, images, rng, unique):
+    name, data, mime = images[i % len(images)]
+    if unique:
+        data = data + rng.randbytes(16)
+    files = {"image": (name, data, mime)}
+
+    if endpoint == "create-patient-profile":
+        form = {"patient_data": json.dumps(patient_data(i))}
+    elif endpoint == "analyze-fillin":
+        form = {}
+    elif endpoint == "analyze-wound":
+        form = {"patient_data": json.dumps({**patient_data(i), **fake_fillin(rng), "temperature": 37.4})}
+    else:
+        form = {"case_data": json.dumps({
+            "patient_profile": patient_data(i),
+            "selected_patient": {"id": f"PT-LOAD-{i % 50:03d}"},
+            "nurse_reviewed": fake_fillin(rng),
+            "ai_analysis": fake_analysis(rng),
+            "urgency": rng.choice(["high_urgent", "medium", "routine"]),
+            "meta": {"sent_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
+        })}
+    return form, files, len(data)
+
+
+#---------- RUN ---------------#
+async def model_usage(http):
+    """Model calls and tokens so far, from the backend's /metrics (None if it has none)."""
+    try:
+        response = await http.get("/metrics")
+    except httpx.HTTPError:
+        return None
+    if response.status_code != 200:
+        return None
+    usage = {"calls": 0}
+    for line in response.text.splitlines():
+        if line.startswith("model_calls_total{"):
+            usage["calls"] += float(line.rsplit(" ", 1)[1])
+        elif line.startswith("model_tokens_total{"):
+            token_type = line.split('type="', 1)[1].split('"', 1)[0]
+            usage[token_type] = usage.get(token_type, 0) + float(line.rsplit(" ", 1)[1])
+    return usage
+
+
+def usage_delta(before, after):
+    if before is None or after is None:
+        return None
+    calls = after["calls"] - before["calls"]
+    delta = {"model_calls": int(calls)}
+    for token_type in ("prompt", "cached", "candidates"):
+        tokens = after.get(token_type, 0) - before.get(token_type, 0)
+        delta[f"{token_type}_tokens_per_call"] = round(tokens / calls, 1) if calls else 0.0
+    # what is billed (and read) at the full input rate
+    delta["uncached_prompt_tokens_per_call"] = round(delta["prompt_tokens_per_call"] - delta["cached_tokens_per_call"], 1)
+    return delta
+
+
+def summarize(latencies_ms, statuses, elapsed_s, sent_bytes):
+    ok = [lat for lat, status in zip(latencies_ms, statuses) if status == 200]
+    by_status = {}
+    for status in statuses:
+        by_status[str(status)] = by_status.get(str(status), 0) + 1
+    summary = {
+        "requests": len(statuses),
+        "ok": len(ok),
+        "statuses": by_status,
+        "elapsed_s": round(elapsed_s, 3),
+        "throughput_rps": round(len(ok) / elapsed_s, 2) if elapsed_s else 0.0,
+        "upload_mb": round(sent_bytes / 1e6, 2),
+    }
+    if ok:
+        summary.update({
+            "p50_ms": round(float(np.percentile(ok, 50)), 1),
+            "p95_ms": round(float(np.percentile(ok, 95)), 1),
+            "p99_ms": round(float(np.percentile(ok, 99)), 1),
+            "mean_ms": round(float(np.mean(ok)), 1),
+            "max_ms": round(float(np.max(ok)), 1),
+        })
+    return summary
+
+
+async def run_level(target, endpoint, concurrency, n_requests, images, rng, unique, timeout_s):
+    latencies, statuses = [], []
+    sent = 0
+    counter = iter(range(n_requests))
+
+    async with httpx.AsyncClient(base_url=target, timeout=timeout_s) as http:
+        async def worker():
+            nonlocal sent
+            for i in counter:
+                form, files, size = build_request(endpoint, i, images, rng, unique)
+                sent += size
+                started = time.perf_counter()
+                try:
+                    response = await http.post(f"/{endpoint}", data=form, files=files)
+                    status = response.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses.append(status)
+
+        usage_before = await model_usage(http)
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        usage = usage_delta(usage_before, await model_usage(http))
+    summary = summarize(latencies, statuses, elapsed, sent)
+    if usage:
+        summary["model_usage"] = usage
+    return summary
+
+
+async def run_all(args, images):
+    rng = random.Random(args.seed)
+    results = {}
+    for endpoint in args.endpoints:
+        results[endpoint] = {}
+        for concurrency in args.concurrency:
+            n_requests = max(args.requests, concurrency)
+            summary = await run_level(args.target, endpoint, concurrency, n_requests, images, rng, args.unique_images, args.timeout)
+            results[endpoint][str(concurrency)] = summary
+            print(f"{endpoint:<24} c={concurrency:<4} {summary['ok']}/{summary['requests']} ok  "
+                  f"{summary['throughput_rps']:>7.2f} rps  p50 {summary.get('p50_ms', float('nan')):>8.1f}  "
+                  f"p95 {summary.get('p95_ms', float('nan')):>8.1f}  p99 {summary.get('p99_ms', float('nan')):>8.1f} ms  "
+                  f"{summary['statuses']}"
+                  + (f"  prompt tok/call {summary['model_usage']['prompt_tokens_per_call']:.0f}"
+                     f" (cached {summary['model_usage']['cached_tokens_per_call']:.0f})" if "model_usage" in summary else ""))
+    return results
+
+
+#---------- SERVERS ---------------#
+def wait_until_up(url, timeout_s=60):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{url} did not come up within {timeout_s}s")
+
+
+def spawn_servers(args, workdir):
+    fake = subprocess.Popen([
+        sys.executable, os.path.join(BACKEND_DIR, "fake_gemini.py"), "--port", str(args.fake_port),
+        "--latency-ms", str(args.fake_latency_ms), "--jitter-ms", str(args.fake_jitter_ms),
+        "--error-rate", str(args.fake_error_rate), "--response-chars", str(args.fake_response_chars),
+        "--input-ms-per-1k-tokens", str(args.fake_input_ms_per_1k_tokens), "--seed", str(args.seed),
+    ])
+    env = {
+        **os.environ,
+        "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY") or "fake",
+        "GEMINI_BASE_URL": f"http://127.0.0.1:{args.fake_port}",
+        "FOSTER_DB_PATH": os.path.join(workdir, "loadtest.db"),
+        "FOSTER_CACHE_DIR": os.path.join(workdir, "cache"),
+        "FOSTER_BLOB_DIR": os.path.join(workdir, "blobs"),
+        "SIMILARITY_INDEX_DIR": os.path.join(workdir, "similarity"),
+        **dict(pair.split("=", 1) for pair in args.backend_env),
+    }
+    port = args.target.rsplit(":", 1)[-1].strip("/")
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", port, "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    wait_until_up(f"http://127.0.0.1:{args.fake_port}/docs")
+    wait_until_up(f"{args.target}/docs")
+    return [backend, fake]
+
+
+#---------- COMPARE ---------------#
+def compare(path_a, path_b):
+    with open(path_a, "r", encoding="utf-8") as f:
+        a = json.load(f)
+    with open(path_b, "r", encoding="utf-8") as f:
+        b = json.load(f)
+    print(f"A: {path_a} ({a['meta']['started_at']})\nB: {path_b} ({b['meta']['started_at']})")
+    for endpoint, levels in b["results"].items():
+        for level, new in levels.items():
+            old = a["results"].get(endpoint, {}).get(level)
+            if not old:
+                continue
+            cells = []
+            old_values = {**old, **(old.get("model_usage") or {})}
+            new_values = {**new, **(new.get("model_usage") or {})}
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "uncached_prompt_tokens_per_call"):
+                if key in old_values and key in new_values and old_values[key]:
+                    before, after = old_values[key], new_values[key]
+                    cells.append(f"{key} {before} -> {after} ({(after - before) / before * 100:+.0f}%)")
+            print(f"{endpoint:<24} c={level:<4} " + "  ".join(cells))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the Foster Ulcer AI backend")
+    parser.add_argument("--target", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoints", type=lambda s: s.split(","), default=ENDPOINTS)
+    parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=100, help="requests per endpoint and concurrency level")
+    parser.add_argument("--images", default=DEFAULT_IMAGES)
+    parser.add_argument("--image-sample", type=int, default=100, help="how many images to sample from --images")
+    parser.add_argument("--unique-images", action=argparse.BooleanOptionalAction, default=True,
+                        help="make every upload unique so the response cache cannot answer it (default: on)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="", help="free-text label stored with the results")
+    parser.add_argument("--out", help="results JSON (default: results/loadtest-<timestamp>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("A", "B"), help="compare two results files and exit")
+
+    spawn = parser.add_argument_group("spawned servers")
+    spawn.add_argument("--spawn", action="store_true", help="start fake_gemini.py and the backend on temporary data")
+    spawn.add_argument("--fake-port", type=int, default=8001)
+    spawn.add_argument("--fake-latency-ms", type=float, default=800.0)
+    spawn.add_argument("--fake-jitter-ms", type=float, default=400.0)
+    spawn.add_argument("--fake-error-rate", type=float, default=0.0)
+    spawn.add_argument("--fake-response-chars", type=int, default=0)
+    spawn.add_argument("--fake-input-ms-per-1k-tokens", type=float, default=0.0)
+    spawn.add_argument("--backend-env", action="append", default=[], metavar="KEY=VALUE",
+                       help="extra environment for the spawned backend, e.g. GEMINI_MAX_CONCURRENCY=4 (repeatable)")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    images = load_images(args.images, args.image_sample, random.Random(args.seed))
+    started_at = datetime.datetime.now()
+    processes = []
+    workdir = tempfile.TemporaryDirectory(prefix="loadtest-")
+    try:
+        if args.spawn:
+            processes = spawn_servers(args, workdir.name)
+        results = asyncio.run(run_all(args, images))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=10)
+        workdir.cleanup()
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=BACKEND_DIR).stdout.strip()
+    except OSError:
+        commit = ""
+    report = {
+        "meta": {
+            "label": args.label,
+            "started_at": started_at.isoformat(timespec="seconds"),
+            "git_commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "target": args.target,
+            "spawned": args.spawn,
+            "unique_images": args.unique_images,
+            "images": len(images),
+            "fake_gemini": {
+                "latency_ms": args.fake_latency_ms, "jitter_ms": args.fake_jitter_ms,
+                "error_rate": args.fake_error_rate, "response_chars": args.fake_response_chars,
+                "input_ms_per_1k_tokens": args.fake_input_ms_per_1k_tokens,
+            } if args.spawn else None,
+            "backend_env": args.backend_env,
+        },
+        "results": results,
+    }
+    out = args.out or os.path.join(BACKEND_DIR, "results", f"loadtest-{started_at:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {out}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
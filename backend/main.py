@@ -1,5 +1,7 @@
 import os
 import io
+import logging
+import asyncio
 import re
 import json
 import pandas as pd
@@ -7,65 +9,58 @@ import requests
 import uuid
 import datetime
 from datetime import date
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from google import genai
-from google.genai import types
 from PIL import Image
 from dotenv import load_dotenv
 
+from model_pool import ModelPoolError, ModelBusyError, ModelTimeoutError
+from scheduler import ModelScheduler
+from response_cache import ResponseCache, make_cache_key
+from image_preprocess import PreprocessSettings, MaxUploadSizeMiddleware, UnsupportedImageError, preprocess_image
+from image_preprocess import stats as preprocess_stats
+from storage import Store
+from data_tables import DataTables, DEFAULT_DATA_ROOT
+from similarity_index import SimilarityIndex
+from triage_model import TriageModel, DEFAULT_MODEL_PATH as DEFAULT_TRIAGE_MODEL_PATH
+from blob_store import BlobStore, BlobNotFoundError, serve as serve_blob
+from dashboard import Dashboard
+from cases import case_rows, patient_id_of, analysis_priority
+from timeline import TimelineStore, CaseNotFoundError, case_records, visit_metrics, build_timeline
+from metrics import MetricsMiddleware, Gauge, register, stage, fillin_sources
+from metrics import render as render_metrics
+from logging_setup import configure_logging
+from prompts import FILLIN_PROMPT_TEMPLATE, ANALYZE_PROMPT_TEMPLATE
+from schemas import SCHEMA_VERSION
+import analysis
+from analysis import make_client, run_fillin, run_analyze, stream_analyze, validate_analysis, replay_fields, InvalidModelOutput
+
 genai_model = "gemini-2.0-flash"
 app = FastAPI()
 
-#---------- FUNCTION ---------------#
-def generate_patient_id(df_patients):
-
-# 1. Get current YYMM prefix (e.g., "2601")
-    current_prefix = date.today().strftime("%y%m")
-    prefix_label = "PT" 
-    
-    # 2. Check if the DataFrame is empty
-    if df_patients.empty:
-        return f"{prefix_label}-{current_prefix}-00001"
-    
-    # 3. Get the last patient_id from the last row
-    last_id = str(df_patients['patient_id'].iloc[-1])
-    
-    try:
-        parts = last_id.split('-')
-        last_date_part = parts[1]        
-        last_running_num = int(parts[2]) 
-        
-        # 4. Check if same month
-        if last_date_part == current_prefix:
-            new_running_num = last_running_num + 1
-        else:
-            new_running_num = 1
-            
-    except (IndexError, ValueError):
-        # Fallback if the last_id format was corrupted
-        new_running_num = 1
-
-    # 5. Format the new code
-    new_code = f"{prefix_label}-{current_prefix}-{new_running_num:05d}"
-    return new_code
-
-
 #---- READ (MOCK UP) DATABASE ------#
 
-df_patients_path="C:/Users/Pawarit/Desktop/GitHub/Foster-Ulcer-AI/Foster-Ulcer-AI/mockup_data/patients.csv"
-df_wound_cases_path="C:/Users/Pawarit/Desktop/GitHub/Foster-Ulcer-AI/Foster-Ulcer-AI/mockup_data/wound_cases.csv"
-df_ai_analysis_path = "C:/Users/Pawarit/Desktop/GitHub/Foster-Ulcer-AI/Foster-Ulcer-AI/mockup_data/ai_analysis.csv"
-df_treatment_plan_path = "C:/Users/Pawarit/Desktop/GitHub/Foster-Ulcer-AI/Foster-Ulcer-AI/mockup_data/treatment_plan.csv"
-df_plan_task_path= "C:/Users/Pawarit/Desktop/GitHub/Foster-Ulcer-AI/Foster-Ulcer-AI/mockup_data/plan_task.csv"
-
-
-df_patients = pd.read_csv(df_patients_path)
-df_wound_cases = pd.read_csv(df_wound_cases_path)
-df_ai_analysis = pd.read_csv(df_ai_analysis_path)
-df_treatment_plan = pd.read_csv(df_treatment_plan_path)
-df_plan_task = pd.read_csv(df_plan_task_path)
-
+# The mockup tables are read with typed columns (and from a Parquet copy under
+# FOSTER_CACHE_DIR when pyarrow is installed); they only seed an empty database.
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.getenv("FOSTER_CACHE_DIR", os.path.join(BACKEND_DIR, ".cache"))
+DATA_ROOT = os.getenv("FOSTER_DATA_ROOT", DEFAULT_DATA_ROOT)
+tables = DataTables(DATA_ROOT, cache_dir=CACHE_DIR)
+
+# New records are written to SQLite (WAL) instead of rewriting the CSVs. An empty
+# database is seeded from mockup_data at startup (SEED_MOCKUP_DATA=0 to start empty;
+# `python storage.py <db_path> <mockup_data_dir>` does the same by hand).
+DB_PATH = os.getenv("FOSTER_DB_PATH", os.path.join(BACKEND_DIR, "foster.db"))
+store = Store(DB_PATH)
+if os.getenv("SEED_MOCKUP_DATA", "1") != "0" and store.is_empty():
+    store.import_mockup_data(tables, only_if_empty=True)   # load source / time per table: GET /table-stats
+
+# Inbox aggregates are read here, follow every committed write of this worker and are
+# re-read when another worker has written (Store.version())
+dashboard = Dashboard()
+store.add_listener(dashboard.on_commit)
+dashboard.load(store)
 
 #-----------------------------------#
 
@@ -90,205 +85,195 @@ app.add_middleware(
 load_dotenv()
 my_key = os.getenv("GEMINI_API_KEY")
 
+# LOG_FORMAT=json for one JSON object per line (log shippers), text for key=value lines
+configure_logging(os.getenv("LOG_LEVEL", "INFO"), os.getenv("LOG_FORMAT", "text"))
+log = logging.getLogger("foster.api")
+
 # Initialize FastAPI and Gemini Client
 app = FastAPI(title="Wound Care AI Analysis API")
-client = genai.Client(api_key=my_key)
-
-# Define Safety Config
-safety_config = [
-    types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="BLOCK_NONE"),
-    types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="BLOCK_NONE"),
-    types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="BLOCK_NONE"),
-    types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="BLOCK_NONE"),
-]
+# GEMINI_BASE_URL lets the app run against a local stand-in (fake_gemini.py)
+client = make_client(my_key, base_url=os.getenv("GEMINI_BASE_URL"))
+# answers are repaired locally first; only fields still invalid after that are asked for again
+analysis.FIX_RETRIES = int(os.getenv("GEMINI_FIX_RETRIES", "1"))
+
+# Every image endpoint shares one preprocessing pipeline (EXIF fix, downscale, re-encode)
+preprocess_settings = PreprocessSettings(
+    max_pixels=int(os.getenv("IMAGE_MAX_PIXELS", "2000000")),
+    output_format=os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG").upper(),
+    jpeg_quality=int(os.getenv("IMAGE_JPEG_QUALITY", "85")),
+    max_upload_bytes=int(float(os.getenv("MAX_UPLOAD_MB", "15")) * 1024 * 1024),
+)
+app.add_middleware(MaxUploadSizeMiddleware, max_bytes=preprocess_settings.max_upload_bytes)
+
+# Outermost middleware: per-route latency, per-stage histograms (metrics.stage) and,
+# with SLOW_REQUEST_MS set, a log line with the stage breakdown of every slow request.
+app.add_middleware(MetricsMiddleware, slow_request_ms=float(os.getenv("SLOW_REQUEST_MS", "0")))
+
+
+async def prepare_image(image_content):
+    try:
+        # decode/resize is CPU work; keep it off the event loop
+        with stage("preprocess"):
+            prepared = await asyncio.to_thread(preprocess_image, image_content, preprocess_settings)
+    except UnsupportedImageError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    log.debug("image preprocessed", extra={
+        "bytes_before": prepared.before_bytes, "bytes_after": prepared.after_bytes,
+        "size_before": prepared.before_size, "size_after": prepared.after_size,
+    })
+    return prepared
+
+# Gemini calls go through a bounded pool so a slow analysis never blocks the event loop
+# and a burst of uploads gets a 429 instead of an ever-growing queue. Slots go to urgent
+# analyses first, then routine analyses, fill-ins and batch work, at most GEMINI_RATE_PER_S
+# calls per second (0 = no limit); identical concurrent requests share one call.
+model_pool = ModelScheduler(
+    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "4")),
+    max_queue=int(os.getenv("GEMINI_MAX_QUEUE", "16")),
+    timeout_s=float(os.getenv("GEMINI_TIMEOUT_S", "60")),
+    rate_per_s=float(os.getenv("GEMINI_RATE_PER_S", "0")),
+    burst=int(os.getenv("GEMINI_RATE_BURST", "4")),
+    max_rate_limit_retries=int(os.getenv("GEMINI_RATE_LIMIT_RETRIES", "2")),
+)
+
+# Resent photos (form retakes, screen back-and-forth, upload retries) are answered from here
+# instead of spending another Gemini call.
+response_cache = ResponseCache(
+    os.path.join(CACHE_DIR, "responses"),
+    ttl_s=float(os.getenv("RESPONSE_CACHE_TTL_S", str(7 * 24 * 3600))),
+    max_memory_entries=int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "256")),
+    max_disk_entries=int(os.getenv("RESPONSE_CACHE_DISK_ENTRIES", "5000")),
+)
+
+# Uploaded photos, stored once per content hash; thumb / preview JPEGs are built in the background
+blob_store = BlobStore(os.getenv("FOSTER_BLOB_DIR", os.path.join(BACKEND_DIR, "blobs")))
+
+# One folder of visit images per case ("Case 1/Baseline.png", "Week 5.png", ...); the images
+# go into the blob store like uploads, the per-case manifest lives under CACHE_DIR/timeline.
+timeline_store = TimelineStore(
+    os.getenv("FOSTER_CASES_ROOT", os.path.join(DATA_ROOT, "Test cases")),
+    cache_dir=CACHE_DIR,
+    blob_store=blob_store,
+)
 
-FILLIN_PROMPT_TEMPLATE ='''Role: You are an expert Wound Care Specialist and Clinical Podiatrist.
-
-Task: Analyze the attached image of the foot ulcer and provide a clinical assessment. Your output must be in a strict JSON format using the schema provided below.
-
-Constraints:
-
-For measurements (width/length), provide estimates based on visual scale if a ruler is present; otherwise, label as "estimated."
-
-Use only the ENUM values provided in the schema.
-
-If a value cannot be determined from the image (like pain or odor), provide a "best-fit" clinical estimate based on the wound morphology and note it as such.
-
-No Newlines: The entire output must be on one single line. Do not use \n or line breaks.
-
-JSON Only: Do not include any conversational text or markdown code blocks (no ```json). Output only the raw string.
-
-
-JSON Schema / Fields to Fill: 
-{ "location_primary": "ENUM (toe, sole, side, heel, dorsal_aspect, medial_malleolus, lateral_malleolus)",
- "location_detail": "string",
- "wound_type": "string",
- "shape": "ENUM (round, oval, irregular, linear, punched_out)",
- "size_width_cm": "float",
- "size_length_cm": "float",
- "depth_category": "ENUM (superficial, partial_thickness, full_thickness, deep, very_deep_exposed_bone_tendon)",
- "bed_slough_pct": "integer",
- "bed_necrotic_pct": "integer",
- "edge_description": "ENUM (smooth, thickened, irregular, rolled_epibole, undermined, calloused)",
- "periwound_status": "ENUM (normal, erythematous, edematous, indurated, macerated, fluctuant, hyperpigmented)",
- "discharge_volume": "ENUM (none, minimal, moderate, heavy)",
- "discharge_type": "ENUM ("serous (clear)", "sanguineous (bloody)", "serosanguineous (pink)", "purulent (yellow/pus)", "seropurulent (cloudy yellow)")",
- "odor_presence": "ENUM (none, faint, moderate, foul, putrid)",
- "pain_score": "integer (0-10)",
- "has_infection": "boolean",
- "skin_condition": "ENUM (healthy, dry, cracked, macerated, fragile, scaling)" }'''
-   
-ANALYZE_PROMPT_TEMPLATE = '''Role: You are an expert Wound Care Specialist & Clinical Podiatrist AI supporting nursing documentation for diabetic foot ulcers (DFUs). Your job is to create a clinician-ready summary, wound description, staging, and a draft treatment plan. You must be cautious, evidence-based, and avoid over-claiming.
-
-IMPORTANT RULES
-1) Multimodal: You will receive (a) text data (demographics, vitals, checklist) and (b) one wound photo. Use BOTH.
-2) If information is missing or unclear, do not guess. Use JSON null for unknown numeric/boolean values and the string "unknown" for unknown text. Do not invent data.
-3) Cross-check: If the photo conflicts with nurse input, politely note the discrepancy and explain what you observe visually.
-4) Safety: Include a clear disclaimer that this is AI-generated and must be verified by a licensed clinician. If urgent red flags are present (systemic infection, rapidly spreading cellulitis, suspected necrotizing infection, critical ischemia, gangrene, exposed bone with systemic signs), recommend urgent escalation.
-5) NO PRESCRIBING: Do not prescribe or give dosing. Do not name specific antibiotics unless they are explicitly provided in the input; instead say “consider per clinician/local protocol.”
-6) JSON STRICTNESS:
-   - Output MUST be valid JSON ONLY. No markdown. No code fences. No extra text.
-   - Output must start with { and end with }.
-   - Use exactly the schema/keys provided below. No extra keys. No trailing commas.
-
-STAGING REQUIREMENT
-- Primary staging must be mapped to wound_stage ENUM: STAGE 1–STAGE 6.
-- Use Wagner grading as the underlying logic, mapped as:
-  • STAGE 1 = Wagner 0 (no open lesion / pre-ulcer)
-  • STAGE 2 = Wagner 1 (superficial ulcer)
-  • STAGE 3 = Wagner 2 (deep to tendon/capsule; no abscess/osteomyelitis)
-  • STAGE 4 = Wagner 3 (deep with abscess/osteomyelitis/joint sepsis)
-  • STAGE 5 = Wagner 4 (localized gangrene)
-  • STAGE 6 = Wagner 5 (extensive gangrene)
-
-STAGING DECISION RULES (do not upstage without evidence)
-- If no open lesion: STAGE 1.
-- If open ulcer and depth is unknown AND no deep structures are visible: default STAGE 2 and lower confidence.
-- If tendon/joint capsule is visible OR probe-to-bone is positive: at least STAGE 3.
-- Only use STAGE 4 if there is evidence of abscess/osteomyelitis/joint sepsis (from checklist, labs, imaging, or clear visual cues). Otherwise phrase as “concern for” inside TEXT.
-- Use STAGE 5–6 only if gangrene/necrosis is clearly present; STAGE 6 if extensive/whole-foot involvement.
-- If you also infer University of Texas (UT) grade/stage, include it inside the “description” text only (do not add new JSON fields).
-
-CONFIDENCE
-- confidence is a number from 0.00 to 1.00.
-- Use this rubric:
-  Start at 0.80 then subtract:
-  -0.15 if image is unclear/poor lighting/out of focus
-  -0.10 if size (LxW) missing
-  -0.15 if depth / probe-to-bone missing
-  -0.10 if infection indicators missing (odor/exudate/temp/systemic symptoms)
-  -0.10 if vascular indicators missing (pulses/cap refill/ABI-TBI/skin temperature)
-  -0.10 if there is a notable text-image discrepancy
-  Clamp final confidence to [0.05, 0.95].
-
-TASK LIST
-- Create 3–10 nurse tasks with short, actionable wording.
-- task_due must be ISO 8601 datetime with timezone +07:00 (Asia/Bangkok), e.g. “2026-01-27T16:00:00+07:00”.
-- If the user did not provide a reference date/time:
-  - Assume today is 2026-01-28 (Asia/Bangkok).
-  - Use reasonable due times:
-    * urgent tasks: today at 16:00:00+07:00
-    * routine follow-up tasks: next day at 10:00:00+07:00
-    * 48–72h follow-ups: set due at 10:00:00+07:00 on day +2 or day +3
-- status for plan and tasks must be exactly "DRAFT".
-
-INPUT YOU WILL RECEIVE (example structure; adapt to actual)
-- Demographics: age, sex, medical history, comorbidities, meds, allergies
-- Vitals: temp, BP, HR, RR, SpO2, glucose (if available)
-- Wound checklist: location, size (LxW, depth), tissue %, exudate, odor, pain, edges, periwound, infection signs, ischemia signs, neuropathy, pulses, cap refill, probe-to-bone, prior ulcers/amputation
-- Photo: one wound image
-
-WHAT TO PRODUCE
-Return JSON with exactly this schema and keys (no extras):
-
-{
-  "AI_analysis": {
-    "creator": "Gemini AI",
-    "wound_stage": "STAGE 1|STAGE 2|STAGE 3|STAGE 4|STAGE 5|STAGE 6",
-    "description": "TEXT",
-    "diagnosis": "TEXT",
-    "confidence": 0.00,
-    "treatment_plan": "TEXT"
-  },
-  "treatment_plan": {
-    "plan_text": "TEXT",
-    "followup_days": 0,
-    "status": "DRAFT",
-    "plan_tasks": [
-      {
-        "task_text": "TEXT",
-        "status": "DRAFT",
-        "task_due": "YYYY-MM-DDTHH:MM:SS+07:00"
-      }
-    ]
-  }
-}
-
-PLAN FIELD CONSISTENCY
-- AI_analysis.treatment_plan TEXT must be a short clinician-facing rationale + escalation guidance.
-- treatment_plan.plan_text must be a nurse-facing action summary that is consistent with AI_analysis.treatment_plan (a condensed version, not conflicting).
-
-CONTENT GUIDANCE (put inside the TEXT fields)
-A) description TEXT must include these labeled sections (as plain text):
-- 1. Patient & Clinical Overview: demographics + vitals; flag abnormal BP/Temp; mention key risk factors (neuropathy, PAD, smoking, renal disease, immunosuppression) if provided.
-- 2. Formal Wound Description: location, size, depth (if known), wound bed tissue types, margins/edges, undermining/tunneling, periwound condition, exudate amount/type, odor, pain.
-- 3. Image Analysis Insights: what you see (slough/granulation/eschar, maceration, erythema, swelling); note discrepancies vs checklist politely.
-- 4. Wound Staging: state mapped Wagner grade + (optional) UT grade/stage; brief justification.
-- 5. Red Flags: list “Red flags noted:” and “Red flags not noted/unknown:” based on available data.
-
-B) diagnosis TEXT:
-- Provide a concise clinical impression (e.g., “Diabetic foot ulcer at [site], [depth], with/without signs of infection, with/without ischemic features.”).
-- If osteomyelitis is possible, phrase as “concern for” and suggest confirmation steps (probe-to-bone, imaging, labs) without claiming certainty.
-
-C) AI_analysis.treatment_plan TEXT (clinician-facing; short):
-- Evidence-based DFU principles: offloading, debridement consideration, moisture balance/dressings, infection assessment, vascular assessment, glycemic control coordination, pain control, patient education, follow-up.
-- Include escalation guidance if red flags.
-- Do not prescribe; do not give dosing; do not name antibiotics unless explicitly given in input.
-
-D) treatment_plan.plan_text (nurse-facing; condensed):
-- Clear nurse-friendly plan summary (what to do + why), consistent with severity and consistent with AI_analysis.treatment_plan.
-
-E) followup_days:
-- Choose a reasonable follow-up interval based on severity:
-  mild superficial/noninfected: 7–14
-  moderate/uncertain infection or significant exudate: 2–7
-  severe infection/gangrene/critical ischemia: 0–1 (urgent)
-- If uncertain, choose a conservative follow-up (e.g., 2–7) and explain inside TEXT.
-
-FINAL SAFETY DISCLAIMER (must appear in BOTH AI_analysis.description and AI_analysis.treatment_plan TEXT)
-“This is an AI-generated draft for clinical documentation support only and must be reviewed and verified by a licensed medical professional before use. Seek urgent medical care if there are signs of severe infection, rapidly worsening redness/swelling, fever, severe pain, or gangrene.”
-
-Now analyze the provided patient data + wound checklist + photo and output JSON only.'''
-
-
-@app.post("/load-dashboard")
-async def load_dashboard():
-    
-    return {"message": "CORS is working!"}
+# "Similar past wounds": compact image descriptors searched in memory; seed it from the
+# image corpus with `python similarity_index.py build ../ai_engine/data`.
+similarity_index = SimilarityIndex(os.getenv("SIMILARITY_INDEX_DIR", os.path.join(CACHE_DIR, "similarity")))
+
+# Offline fill-in draft (kNN over the similarity descriptors, trained on past Gemini fill-ins with
+# `python triage_model.py train fillin_results.ndjson`). FILLIN_MODE: gemini (default), local = the
+# draft only, auto = the draft when every choice field reaches FILLIN_LOCAL_MIN_CONFIDENCE, else Gemini.
+TRIAGE_MODEL_PATH = os.getenv("TRIAGE_MODEL_PATH", DEFAULT_TRIAGE_MODEL_PATH)
+triage_model = TriageModel.load(TRIAGE_MODEL_PATH) if os.path.exists(TRIAGE_MODEL_PATH) else None
+FILLIN_MODES = ("gemini", "local", "auto")
+FILLIN_MODE = os.getenv("FILLIN_MODE", "gemini")
+FILLIN_LOCAL_MIN_CONFIDENCE = float(os.getenv("FILLIN_LOCAL_MIN_CONFIDENCE", "0.8"))
+
+
+
+async def store_upload(image_content):
+    try:
+        with stage("blob_store"):
+            return await asyncio.to_thread(blob_store.put, image_content)
+    except UnsupportedImageError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+register(Gauge("model_pool_calls", "Model calls running / waiting for a slot", lambda: {
+    ("running",): model_pool.stats["running"], ("waiting",): model_pool.stats["waiting"],
+}, labels=["state"]))
+register(Gauge("model_queue_depth", "Model calls waiting for a slot, by priority class", lambda: {
+    (name,): stats["queued"] for name, stats in model_pool.class_stats.items()
+}, labels=["priority"]))
+register(Gauge("model_rate_limit_paused_seconds", "Remaining 429 backoff before the next model call", lambda: {
+    (): round(model_pool.bucket.paused_s, 3),
+}))
+register(Gauge("response_cache_events", "Response cache lookups and writes since start", lambda: {
+    (k,): v for k, v in response_cache.stats.items() if k in ("memory_hits", "disk_hits", "misses", "puts", "evictions")
+}, labels=["event"]))
+
+
+@app.exception_handler(ModelPoolError)
+async def model_pool_error_handler(request: Request, exc: ModelPoolError):
+    if isinstance(exc, ModelBusyError):
+        return JSONResponse(status_code=429, content={"detail": "AI service is busy, please retry shortly"}, headers={"Retry-After": "5"})
+    if isinstance(exc, ModelTimeoutError):
+        return JSONResponse(status_code=504, content={"detail": str(exc)})
+    # ClientDisconnectedError: nobody is listening any more, 499 is only for the access log
+    return JSONResponse(status_code=499, content={"detail": str(exc)})
+
+
+@app.exception_handler(InvalidModelOutput)
+async def invalid_model_output_handler(request: Request, exc: InvalidModelOutput):
+    return JSONResponse(status_code=502, content={"detail": str(exc)})
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/cache-stats")
+async def cache_stats():
+    return response_cache.stats
+
+@app.get("/scheduler-stats")
+async def scheduler_stats():
+    """Model call queue per priority class: depth, calls granted, wait times, coalesced and 429'd calls."""
+    return model_pool.stats
+
+@app.get("/preprocess-stats")
+async def get_preprocess_stats():
+    return preprocess_stats.as_dict()
+
+@app.get("/similarity-stats")
+async def similarity_stats():
+    return similarity_index.stats
+
+@app.get("/table-stats")
+async def table_stats():
+    # load source / time / memory of the mockup tables read so far
+    return tables.stats
+
+@app.api_route("/load-dashboard", methods=["GET", "POST"])
+async def load_dashboard(request: Request):
+    # a database read when another worker has written since the last snapshot
+    etag, body = await asyncio.to_thread(dashboard.snapshot)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    # polling clients send back the last ETag; an unchanged inbox costs a bodiless 304
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=body, headers=headers)
+
+@app.post("/tasks/{task_id}/complete")
+async def complete_task(task_id: str, done_by: str = Form("nurse")):
+    done_time = datetime.datetime.now().isoformat(timespec="seconds")
+    task = await asyncio.to_thread(
+        store.update, "plan_task", "task_id", task_id, {"status": "COMPLETED", "done_time": done_time, "done_by": done_by}
+    )
+    if task is None:
+        raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+    return {"status": "success", "task": task}
 
 @app.post("/create-patient-profile")
 async def create_patient_profile(
     patient_data: str = Form(...),
     image: UploadFile = File(...)
 ):
-    global df_patients # Required to update the global DataFrame
     try:
-        # Decode JSON string
-        data = json.loads(patient_data)
+        with stage("parse"):
+            # Decode JSON string
+            data = json.loads(patient_data)
 
         if not data.get("patient_name", "").strip():
             raise HTTPException(status_code=400, detail="patient_name is required")
 
-        ## generate patient_id
-        patient_id = generate_patient_id(df_patients)
-        created_at = data.get("created_at") or datetime.utcnow().isoformat()
+        with stage("read_upload"):
+            image_content = await image.read()
+        image_url = f"/images/{await store_upload(image_content)}"
 
-        data["patient_id"] = patient_id
-        data["created_at"] = created_at
+        created_at = data.get("created_at") or datetime.datetime.utcnow().isoformat()
 
-        ## insert new record
+        ## insert new record (patient_id is allocated inside the same transaction)
         record = {
-            "patient_id": patient_id,
             "patient_name": data.get("patient_name"),
             "phone_no": data.get("phone_no"),
             "dob": data.get("dob"),
@@ -298,18 +283,19 @@ async def create_patient_profile(
             "status": 'Active',
             "occupation": data.get("occupation"),
             "medical_history": data.get("medical_history"),
-            "image_url": None, # You can handle file saving logic here to update this
+            "image_url": image_url,
             "created_by": "admin",
             "created_at": created_at,
         }
-        
-        # Correctly update the global DataFrame
-        new_row = pd.DataFrame([record])
-        df_patients = pd.concat([df_patients, new_row], ignore_index=True)
 
-        df_patients.to_csv(df_patients_path,index=False)
+        with stage("db_write"):
+            patient_id = await asyncio.to_thread(store.create_patient, record)
 
-        print("create-patient-profile success for:", patient_id)
+        data["patient_id"] = patient_id
+        data["created_at"] = created_at
+        data["image_url"] = image_url
+
+        log.info("patient created", extra={"patient_id": patient_id})
 
         return {
             "status": "success",
@@ -317,99 +303,254 @@ async def create_patient_profile(
             "patient_profile": data,
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
+        log.exception("request failed")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/analyze-fillin")
 async def fill_in(
-    image: UploadFile = File(...)   # Received as a file upload
+    request: Request,
+    image: UploadFile = File(...),  # Received as a file upload
+    mode: str | None = None,        # ?mode=gemini|local|auto, FILLIN_MODE by default
 ):
+    mode = mode or FILLIN_MODE
+    if mode not in FILLIN_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(FILLIN_MODES)}")
+    if mode != "gemini" and triage_model is None:
+        if mode == "local":
+            raise HTTPException(status_code=503, detail="no local fill-in model loaded")
+        mode = "gemini"   # auto without a model: plain Gemini fill-in
     try:
-        image_content = await image.read()
-        img = Image.open(io.BytesIO(image_content))
-
-        full_prompt = f"{FILLIN_PROMPT_TEMPLATE}"
-
-        response = client.models.generate_content(
-            model=genai_model,
-            contents=[full_prompt, img],
-            config=types.GenerateContentConfig(
-                safety_settings=safety_config,
-                temperature=0.2,
-                response_mime_type="application/json"
-            )
-        )
-
-        # 4. Handle Response
-        if response.candidates:
-            data_dict = json.loads(response.text)
-            df = pd.DataFrame([data_dict])
-            print(df)
-            raw_text = response.text.strip().replace("```json", "").replace("```", "")
-            data_dict = json.loads(raw_text)
-            return {"status": "success", "analysis": data_dict}
-        else:
-            return {
-                "status": "blocked", 
-                "reason": str(response.prompt_feedback.block_reason)
-            }
-
+        with stage("read_upload"):
+            image_content = await image.read()
+
+        # a Gemini answer already on hand beats the local draft
+        with stage("cache_lookup"):
+            cache_key = make_cache_key(image_content, FILLIN_PROMPT_TEMPLATE, genai_model, extra=f"{preprocess_settings.signature}|{SCHEMA_VERSION}")
+            cached = await response_cache.aget(cache_key) if mode != "local" else None
+        if cached is not None:
+            fillin_sources.inc(mode=mode, source="cache")
+            return {"status": "success", "analysis": cached, "source": "gemini"}
+
+        if mode != "gemini":
+            try:
+                with stage("triage"):
+                    draft = await asyncio.to_thread(triage_model.predict_bytes, image_content)
+            except UnsupportedImageError as e:
+                raise HTTPException(status_code=415, detail=str(e))
+            if mode == "local" or TriageModel.confident(draft["confidence"], FILLIN_LOCAL_MIN_CONFIDENCE):
+                fillin_sources.inc(mode=mode, source="local")
+                return {"status": "success", "analysis": draft["fields"], "confidence": draft["confidence"], "source": "local"}
+
+        prepared = await prepare_image(image_content)
+        result = await run_fillin(client, genai_model, prepared, model_pool, request=request, key=cache_key)
+        if result["status"] == "success":
+            fillin_sources.inc(mode=mode, source="gemini")
+            with stage("cache_store"):
+                await response_cache.aput(cache_key, result["analysis"])
+            result["source"] = "gemini"
+        return result
+
+    except (HTTPException, ModelPoolError, InvalidModelOutput):
+        raise
     except Exception as e:
+        log.exception("request failed")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/analyze-wound")
 async def analyze_wound(
+    request: Request,
     patient_data: str = Form(...),  # Received as a string/JSON from frontend
     image: UploadFile = File(...)   # Received as a file upload
 ):
     try:
-        print(f"Sending this payload for wound analyzing: {patient_data}")
-        image_content = await image.read()
-        img = Image.open(io.BytesIO(image_content))
-
-        full_prompt = f"Today is {date.today()}\n\n{ANALYZE_PROMPT_TEMPLATE}\n\n===DATA INPUT===\n{patient_data}"
-
-        response = client.models.generate_content(
-            model=genai_model,
-            contents=[full_prompt, img],
-            config=types.GenerateContentConfig(
-                safety_settings=safety_config,
-                temperature=0.2,
-                response_mime_type="application/json"
-            )
-        )
-
-        # 4. Handle Response
-        if response.candidates:
-            print(response.text)
-            return {"status": "success", "analysis": response.text}
-        else:
-            return {
-                "status": "blocked", 
-                "reason": str(response.prompt_feedback.block_reason)
-            }
-
+        log.debug("analyze-wound payload", extra={"patient_data": patient_data})
+        with stage("read_upload"):
+            image_content = await image.read()
+
+        with stage("cache_lookup"):
+            # the prompt carries today's date (task_due is derived from it), so it is part of the key
+            cache_key = make_cache_key(image_content, ANALYZE_PROMPT_TEMPLATE, genai_model, patient_data, extra=f"{date.today()}|{preprocess_settings.signature}|{SCHEMA_VERSION}")
+            cached = await response_cache.aget(cache_key)
+        if cached is not None:
+            return {"status": "success", "analysis": cached}
+
+        prepared = await prepare_image(image_content)
+        priority = await urgency_class(patient_data)
+        result = await run_analyze(client, genai_model, patient_data, prepared, model_pool, request=request,
+                                   priority=priority, key=cache_key)
+        if result["status"] == "success":
+            with stage("cache_store"):
+                await response_cache.aput(cache_key, result["analysis"])
+        return result
+
+    except (HTTPException, ModelPoolError, InvalidModelOutput):
+        raise
     except Exception as e:
+        log.exception("request failed")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def urgency_class(patient_data):
+    """Scheduler class for an analysis: the payload's urgency / red flags, else the patient's last case."""
+    priority = analysis_priority(patient_data)
+    if priority == "urgent":
+        return priority
+    try:
+        patient_id = patient_id_of(json.loads(patient_data))
+    except (ValueError, AttributeError):
+        return priority
+    if not patient_id:
+        return priority
+    cases = await asyncio.to_thread(store.find, "wound_cases", patient_id=patient_id)
+    return analysis_priority(patient_data, cases[-1].get("urgentcy") if cases else None)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/analyze-wound-stream")
+async def analyze_wound_stream(
+    patient_data: str = Form(...),
+    image: UploadFile = File(...)
+):
+    """
+    Server-Sent Events version of /analyze-wound. Events:
+      chunk  {"text": ...}           raw model output as it arrives
+      field  {"path": ..., "value", "provisional"}  a JSON field is complete (e.g. AI_analysis.wound_stage),
+                                     locally repaired; provisional = invalid, "final" brings the fixed value
+      final  {"status": ..., "analysis": {...}}  the validated document
+      error  {"detail": ...}
+    """
+    image_content = await image.read()
+    cache_key = make_cache_key(image_content, ANALYZE_PROMPT_TEMPLATE, genai_model, patient_data, extra=f"{date.today()}|{preprocess_settings.signature}|{SCHEMA_VERSION}")
+    cached = await response_cache.aget(cache_key)
+
+    if cached is None:
+        prepared = await prepare_image(image_content)
+        priority = await urgency_class(patient_data)
+        # reject up front so an overloaded server answers 429 rather than a 200 stream with an error in it
+        model_pool.check_capacity()
+
+    async def events():
+        if cached is not None:
+            doc = validate_analysis(cached)
+            for path, value, valid in replay_fields(doc):
+                yield sse_event("field", {"path": path, "value": value, "provisional": not valid})
+            yield sse_event("final", {"status": "success", "analysis": doc})
+            return
+        try:
+            async for kind, payload in stream_analyze(client, genai_model, patient_data, prepared, model_pool, priority=priority):
+                if kind == "chunk":
+                    yield sse_event("chunk", {"text": payload})
+                elif kind == "field":
+                    path, value, valid = payload
+                    yield sse_event("field", {"path": path, "value": value, "provisional": not valid})
+                else:
+                    if payload["status"] == "success":
+                        await response_cache.aput(cache_key, payload["analysis"])
+                    yield sse_event("final", payload)
+        except Exception as e:
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/create-case")
 async def analyze_wound(
     case_data: str = Form(...),  # Received as a string/JSON from frontend
     image: UploadFile = File(...)   # Received as a file upload
 ):
     try:
-        image_content = await image.read()
-        img = Image.open(io.BytesIO(image_content))
-
-        print(case_data)
-        img.show()
+        log.debug("create-case payload", extra={"case_data": case_data})
+
+        with stage("parse"):
+            try:
+                case = json.loads(case_data)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"case_data is not valid JSON: {e}")
+            if not isinstance(case, dict):
+                raise HTTPException(status_code=400, detail="case_data must be a JSON object")
+
+        with stage("read_upload"):
+            image_content = await image.read()
+        image_id = await store_upload(image_content)
+
+        with stage("parse"):
+            now = datetime.datetime.now().isoformat(timespec="seconds")
+            try:
+                record, analysis, plan, tasks = case_rows(case, genai_model, now, image_id=image_id)
+            except ValueError as e:   # e.g. an ai_analysis string that is not JSON
+                raise HTTPException(status_code=400, detail=f"Invalid case_data: {e}")
+        with stage("db_write"):
+            ids = await asyncio.to_thread(store.create_case, record, analysis, plan, tasks)
+
+        with stage("similarity_index"):
+            await asyncio.to_thread(
+                similarity_index.add,
+                image_content,
+                {"source": "create-case", "record_id": ids["record_id"], "patient_id": record["patient_id"], "urgency": case.get("urgency")},
+            )
+        log.info("case created", extra={**ids, "image_id": image_id})
 
-        return {"status": "success"}
+        return {"status": "success", **ids, "image_id": image_id, "image_url": f"/images/{image_id}"}
+    except HTTPException:
+        raise
     except Exception as e:
+        log.exception("request failed")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+#---------- IMAGES ---------------#
+@app.api_route("/images/{blob_id}", methods=["GET", "HEAD"])
+async def get_image(blob_id: str, request: Request):
+    try:
+        path, mime_type = blob_store.original(blob_id)
+    except BlobNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return serve_blob(request, path, mime_type, etag=f'"{blob_id}"')
+
+@app.api_route("/images/{blob_id}/{variant}", methods=["GET", "HEAD"])
+async def get_image_variant(blob_id: str, variant: str, request: Request):
+    """variant: thumb (256 px) or preview (1024 px); list screens should never need the original."""
+    try:
+        path, mime_type = await asyncio.to_thread(blob_store.derivative, blob_id, variant)
+    except BlobNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return serve_blob(request, path, mime_type, etag=f'"{blob_id}-{variant}"')
+
+
+#---------- CASE TIMELINE ---------------#
+@app.get("/cases/{case_id}/timeline")
+async def case_timeline(case_id: str):
+    try:
+        # only new / changed visit images are read and stored, the rest comes from the manifest
+        visits = await asyncio.to_thread(timeline_store.visits, case_id)
+    except CaseNotFoundError:
+        visits = []   # a case that only exists in the database
+
+    records, analyses = await asyncio.to_thread(case_records, store, case_id, visits)
+    if not visits and not records:
+        raise HTTPException(status_code=404, detail=f"Case {case_id} not found")
+    return build_timeline(case_id, visits, visit_metrics(records, analyses), blob_store)
+
+#---------- SIMILAR WOUNDS ---------------#
+@app.post("/similar-wounds")
+async def similar_wounds(
+    image: UploadFile = File(...),
+    k: int = Form(10),
+):
+    image_content = await image.read()
+    try:
+        hits = await asyncio.to_thread(similarity_index.query_bytes, image_content, max(1, min(k, 100)))
+    except (OSError, ValueError) as e:   # PIL: not an image we can decode
+        raise HTTPException(status_code=415, detail=f"Unsupported image: {e}")
+    return {"results": hits, "indexed_images": len(similarity_index)}
+
 
 if __name__ == "__main__":
     import uvicorn
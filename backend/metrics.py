@@ -0,0 +1,217 @@
+"""
+Prometheus-format metrics and per-request stage timing.
+
+    with stage("preprocess"):
+        ...
+
+Stages are collected per request through a context variable set by
+MetricsMiddleware. When the request finishes they go into the stage histogram,
+and into the slow-request log if the request took longer than `slow_request_ms`.
+Model calls report token usage and outcome through record_model_call().
+Everything is served in the text exposition format by render().
+"""
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+log = logging.getLogger("foster.metrics")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+#---------- METRIC TYPES ---------------#
+def _label_text(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), key + (repr(bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), key + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Read at scrape time from `fn() -> {label value tuple | (): value}`."""
+
+    def __init__(self, name, help, fn, labels=()):
+        self.name, self.help, self.fn, self.labels = name, help, fn, tuple(labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self.fn().items()):
+            lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+#---------- APP METRICS ---------------#
+http_requests = register(Counter("http_requests_total", "HTTP requests by route and status", ["method", "route", "status"]))
+http_duration = register(Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route"]))
+stage_duration = register(Histogram("request_stage_duration_seconds", "Time spent per stage of a request", ["route", "stage"]))
+model_calls = register(Counter("model_calls_total", "Model calls by kind and outcome (success / blocked / error)", ["kind", "outcome"]))
+model_errors = register(Counter("model_errors_total", "Failed model calls by exception type", ["kind", "error"]))
+model_tokens = register(Counter("model_tokens_total", "Tokens reported in the model's usage metadata", ["kind", "type"]))
+model_duration = register(Histogram("model_call_duration_seconds", "Model API round trip per upstream call (queueing: model_queue_wait_seconds)", ["kind"]))
+coalesced_calls = register(Counter("model_calls_coalesced_total", "Requests answered by an identical model call already in flight", ["priority"]))
+queue_wait = register(Histogram("model_queue_wait_seconds", "Time a model call waited for a slot, by priority class", ["priority"]))
+validation_events = register(Counter("model_output_validations_total",
+                                     "Model answers by validation outcome (valid / repaired / retried / invalid)", ["kind", "outcome"]))
+fillin_sources = register(Counter("fillin_answers_total", "Fill-in answers by mode and source (cache / local / gemini)", ["mode", "source"]))
+
+
+#---------- STAGES ---------------#
+_trace = contextvars.ContextVar("request_trace", default=None)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as one stage of the current request (no-op outside a request)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((name, time.perf_counter() - started))
+
+
+def record_model_call(kind, seconds, outcome, usage=None, error=None):
+    """outcome: success / blocked / error; usage: the response's usage_metadata (may be None)."""
+    model_calls.inc(kind=kind, outcome=outcome)
+    model_duration.observe(seconds, kind=kind)
+    if error is not None:
+        model_errors.inc(kind=kind, error=type(error).__name__)
+    if usage is not None:
+        for token_type, attr in (("prompt", "prompt_token_count"), ("candidates", "candidates_token_count"),
+                                 ("cached", "cached_content_token_count"), ("total", "total_token_count")):
+            value = getattr(usage, attr, None)
+            if value:
+                model_tokens.inc(value, kind=kind, type=token_type)
+
+
+async def timed_model_call(kind, call, is_blocked):
+    """
+    Await `call` (the coroutine of one upstream request), recording duration, outcome
+    and token usage. Wrap it inside the pool's call factory, so a call shared by
+    several requests (single-flight) and every 429 retry is counted exactly once.
+    """
+    started = time.perf_counter()
+    try:
+        response = await call
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        record_model_call(kind, time.perf_counter() - started, "error", error=e)
+        raise
+    outcome = "blocked" if is_blocked(response) else "success"
+    record_model_call(kind, time.perf_counter() - started, outcome, getattr(response, "usage_metadata", None))
+    return response
+
+
+#---------- MIDDLEWARE ---------------#
+class MetricsMiddleware:
+    """ASGI middleware: request count/latency, stage histograms and the slow-request log."""
+
+    def __init__(self, app, slow_request_ms=0.0):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = []
+        token = _trace.set(trace)
+        status = {"code": 500}
+        started = time.perf_counter()
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture_send)
+        finally:
+            _trace.reset(token)
+            seconds = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            http_requests.inc(method=method, route=route, status=str(status["code"]))
+            http_duration.observe(seconds, method=method, route=route)
+            stages = {}
+            for name, stage_seconds in trace:
+                stage_duration.observe(stage_seconds, route=route, stage=name)
+                stages[name] = round(stages.get(name, 0.0) + stage_seconds * 1000, 1)
+            # whatever no stage covered: multipart parsing, routing, response serialisation
+            stages["other"] = round(seconds * 1000 - sum(stages.values()), 1)
+            if self.slow_request_ms and seconds * 1000 >= self.slow_request_ms:
+                log.warning("slow request", extra={
+                    "route": route, "method": method, "status": status["code"],
+                    "duration_ms": round(seconds * 1000, 1), "stages_ms": stages,
+                })
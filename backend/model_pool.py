@@ -0,0 +1,136 @@
+import asyncio
+
+
+#---------- ERRORS ---------------#
+class ModelPoolError(Exception):
+    """Base class for errors raised while waiting on / running a model call."""
+
+
+class ModelBusyError(ModelPoolError):
+    """The pool already holds as many calls as it is allowed to queue."""
+
+
+class ModelTimeoutError(ModelPoolError):
+    """The call did not finish before its deadline."""
+
+
+class ClientDisconnectedError(ModelPoolError):
+    """The HTTP client went away, so the call was cancelled."""
+
+
+#---------- POOL ---------------#
+class ModelPool:
+    """
+    Bounded async worker pool for Gemini calls.
+
+    At most `max_concurrency` calls run at once and at most `max_queue` more
+    wait for a slot; anything beyond that is rejected with ModelBusyError so the
+    endpoint can answer 429 instead of piling up work. Every call gets a deadline
+    (queue wait included) and is cancelled if the caller disconnects.
+    """
+
+    def __init__(self, max_concurrency=4, max_queue=16, timeout_s=60.0, disconnect_poll_s=0.5):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout_s = timeout_s
+        self.disconnect_poll_s = disconnect_poll_s
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._pending = 0   # waiting + running
+        self._running = 0
+
+    @property
+    def stats(self):
+        return {
+            "running": self._running,
+            "waiting": self._pending - self._running,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
+
+    async def _acquire(self, **options):
+        await self._slots.acquire()
+
+    def _release(self, **options):
+        self._slots.release()
+
+    async def _run_in_slot(self, call_factory, **options):
+        await self._acquire(**options)
+        self._running += 1
+        try:
+            return await call_factory()
+        finally:
+            self._running -= 1
+            self._release(**options)
+
+    def check_capacity(self):
+        if self._pending >= self.max_concurrency + self.max_queue:
+            raise ModelBusyError("model queue is full")
+
+    async def _watch_disconnect(self, request):
+        while not await request.is_disconnected():
+            await asyncio.sleep(self.disconnect_poll_s)
+
+    async def run(self, call_factory, request=None, timeout_s=None, **options):
+        """
+        Run `call_factory()` (a zero-arg function returning an awaitable) inside the pool.
+
+        `request` is the Starlette request of the endpoint; when given, the call is
+        cancelled as soon as the client disconnects.
+        """
+        self.check_capacity()
+
+        self._pending += 1
+        call_task = asyncio.ensure_future(self._run_in_slot(call_factory, **options))
+        watch_task = asyncio.ensure_future(self._watch_disconnect(request)) if request is not None else None
+        try:
+            waiting = {call_task} if watch_task is None else {call_task, watch_task}
+            done, _ = await asyncio.wait(
+                waiting,
+                timeout=timeout_s or self.timeout_s,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if call_task in done:
+                return call_task.result()
+            if watch_task is not None and watch_task in done:
+                raise ClientDisconnectedError("client disconnected")
+            raise ModelTimeoutError(f"model call exceeded {timeout_s or self.timeout_s:.0f}s")
+        finally:
+            self._pending -= 1
+            leftovers = [t for t in (call_task, watch_task) if t is not None and not t.done()]
+            for task in leftovers:
+                task.cancel()
+            # let cancelled calls give their slot back before we return
+            await asyncio.gather(*leftovers, return_exceptions=True)
+
+    async def stream(self, stream_factory, timeout_s=None, **options):
+        """
+        Streaming variant of run(): `stream_factory()` returns an awaitable resolving to
+        an async iterator (e.g. generate_content_stream). The slot is held until the
+        stream is exhausted; the deadline covers the whole stream. Client disconnects
+        are handled by the caller closing this generator (StreamingResponse does).
+        """
+        self.check_capacity()
+
+        self._pending += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout_s or self.timeout_s)
+        acquired = False
+        try:
+            try:
+                await asyncio.wait_for(self._acquire(**options), deadline - loop.time())
+                acquired = True
+                self._running += 1
+                iterator = (await asyncio.wait_for(stream_factory(), deadline - loop.time())).__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(iterator.__anext__(), max(0.0, deadline - loop.time()))
+                    except StopAsyncIteration:
+                        return
+                    yield chunk
+            except asyncio.TimeoutError:
+                raise ModelTimeoutError(f"model stream exceeded {timeout_s or self.timeout_s:.0f}s")
+        finally:
+            self._pending -= 1
+            if acquired:
+                self._running -= 1
+                self._release(**options)
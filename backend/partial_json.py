@@ -0,0 +1,94 @@
+import json
+
+
+WHITESPACE = " \t\r\n"
+LITERAL_CHARS = set("+-0123456789.eEtrufalsn")
+
+
+class PartialJSONParser:
+    """
+    Incremental JSON scanner for streamed model output.
+
+    Feed it text as it arrives; every call returns the scalar fields (string,
+    number, bool, null) that became complete in that chunk, as (path, value) pairs
+    with dotted paths, e.g. ("AI_analysis.wound_stage", "STAGE 2") or
+    ("treatment_plan.plan_tasks.0.task_due", "..."). Numbers are only reported once
+    the character after them arrives, so a "0.8" is never mistaken for "0.85".
+    """
+
+    def __init__(self):
+        self._stack = []        # frames: {"kind": "object"|"array", "key": str|int|None, "expect_key": bool}
+        self._string = None     # raw chars of the string being read (escapes kept)
+        self._string_is_key = False
+        self._escape = False
+        self._literal = None    # chars of the number / true / false / null being read
+        self.done = False       # top-level value closed
+
+    def _path(self):
+        return ".".join(str(f["key"]) for f in self._stack if f["key"] is not None)
+
+    def _complete(self, value):
+        return (self._path(), value)
+
+    def feed(self, chunk):
+        events = []
+        for ch in chunk:
+            if self._string is not None:
+                if self._escape:
+                    self._escape = False
+                    self._string.append(ch)
+                elif ch == "\\":
+                    self._escape = True
+                    self._string.append(ch)
+                elif ch == '"':
+                    text = json.loads('"' + "".join(self._string) + '"')
+                    self._string = None
+                    if self._string_is_key:
+                        self._stack[-1]["key"] = text
+                        self._string_is_key = False
+                    else:
+                        events.append(self._complete(text))
+                else:
+                    self._string.append(ch)
+                continue
+
+            if self._literal is not None:
+                if ch in LITERAL_CHARS:
+                    self._literal.append(ch)
+                    continue
+                try:
+                    events.append(self._complete(json.loads("".join(self._literal))))
+                except ValueError:
+                    pass   # not valid JSON; the final full parse will report it
+                self._literal = None
+                # fall through: ch is the delimiter that ended the literal
+
+            if ch in WHITESPACE:
+                continue
+            if not self._stack and ch not in "{[":
+                continue   # stray text around the document, e.g. a ```json fence
+            top = self._stack[-1] if self._stack else None
+            if ch == '"':
+                self._string = []
+                self._string_is_key = top is not None and top["kind"] == "object" and top["expect_key"]
+            elif ch == "{":
+                self._stack.append({"kind": "object", "key": None, "expect_key": True})
+            elif ch == "[":
+                self._stack.append({"kind": "array", "key": 0, "expect_key": False})
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if not self._stack:
+                    self.done = True
+            elif ch == ":":
+                if top is not None:
+                    top["expect_key"] = False
+            elif ch == ",":
+                if top is not None and top["kind"] == "object":
+                    top["expect_key"] = True
+                    top["key"] = None
+                elif top is not None:
+                    top["key"] += 1
+            else:
+                self._literal = [ch]
+        return events
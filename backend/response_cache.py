@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def make_cache_key(image_bytes, prompt_template, model, patient_data=None, extra=None):
+    """
+    Content-addressed key for one model request.
+
+    patient_data is normalized (parsed and re-dumped with sorted keys) so that the
+    same form sent with a different key order or whitespace still hits.
+    """
+    if patient_data is None:
+        normalized = ""
+    else:
+        try:
+            normalized = json.dumps(json.loads(patient_data), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        except (TypeError, ValueError):
+            normalized = str(patient_data).strip()
+
+    h = hashlib.sha256()
+    for part in (hashlib.sha256(image_bytes).hexdigest(), prompt_template, model, normalized, extra or ""):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for model responses: an in-memory LRU in front of a directory
+    of JSON files (one file per key). Entries expire after `ttl_s`; the memory tier
+    is capped at `max_memory_entries`, the disk tier at `max_disk_entries`
+    (oldest files are removed first).
+
+    Async handlers use aget() / aput(): memory hits are answered on the event loop,
+    file reads and writes run in a worker thread.
+    """
+
+    def __init__(self, cache_dir, ttl_s=7 * 24 * 3600, max_memory_entries=256, max_disk_entries=5000):
+        self.cache_dir = cache_dir
+        self.ttl_s = ttl_s
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()   # key -> (created_at, value)
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "puts": 0, "evictions": 0}
+        self._lock = threading.Lock()   # memory tier + counters, shared with the disk worker threads
+        self._evict_lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._disk_entries = sum(1 for e in os.scandir(self.cache_dir) if e.name.endswith(".json"))
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _expired(self, created_at):
+        return self.ttl_s is not None and time.time() - created_at > self.ttl_s
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def _remember(self, key, created_at, value):
+        with self._lock:
+            self._memory[key] = (created_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self._disk_entries -= 1
+        return True
+
+    #---------- MEMORY TIER ---------------#
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            created_at, value = entry
+            if self._expired(created_at):
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            self.counters["memory_hits"] += 1
+            return value
+
+    #---------- DISK TIER ---------------#
+    def _disk_get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._count("misses")
+            return None
+
+        if self._expired(stored["created_at"]):
+            if self._remove_file(path):
+                self._count("evictions")
+            self._count("misses")
+            return None
+
+        self._remember(key, stored["created_at"], stored["value"])
+        self._count("disk_hits")
+        return stored["value"]
+
+    def _disk_put(self, key, created_at, value):
+        path = self._path(key)
+        existed = os.path.exists(path)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created_at": created_at, "value": value}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)   # atomic, readers never see a half-written file
+        with self._lock:
+            if not existed:
+                self._disk_entries += 1
+            self.counters["puts"] += 1
+            over = self._disk_entries > self.max_disk_entries
+        if over:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        if not self._evict_lock.acquire(blocking=False):
+            return   # another put is already trimming the directory
+        try:
+            files = sorted(
+                (e for e in os.scandir(self.cache_dir) if e.name.endswith(".json")),
+                key=lambda e: e.stat().st_mtime,
+            )
+            with self._lock:
+                self._disk_entries = len(files)
+            # trim to 90% so we don't rescan the directory on every following put
+            target = int(self.max_disk_entries * 0.9)
+            for entry in files[: max(0, len(files) - target)]:
+                if self._remove_file(entry.path):
+                    self._count("evictions")
+        finally:
+            self._evict_lock.release()
+
+    #---------- API ---------------#
+    def get(self, key):
+        value = self._memory_get(key)
+        return value if value is not None else self._disk_get(key)
+
+    def put(self, key, value):
+        created_at = time.time()
+        self._remember(key, created_at, value)
+        self._disk_put(key, created_at, value)
+
+    async def aget(self, key):
+        value = self._memory_get(key)
+        return value if value is not None else await asyncio.to_thread(self._disk_get, key)
+
+    async def aput(self, key, value):
+        created_at = time.time()
+        self._remember(key, created_at, value)
+        await asyncio.to_thread(self._disk_put, key, created_at, value)
+
+    @property
+    def stats(self):
+        with self._lock:
+            return self._stats()
+
+    def _stats(self):
+        lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        return {
+            **self.counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": self._disk_entries,
+        }
@@ -0,0 +1,252 @@
+"""
+Priority scheduling, rate limiting and single-flight for model calls.
+
+ModelScheduler is a ModelPool whose slots are handed out by priority class
+(urgent analysis > routine analysis > fill-in > batch) instead of FIFO, and only
+when the token bucket allows another call to the API. A 429 from the API pauses
+the bucket (for the Retry-After / RetryInfo delay when given, exponential otherwise) and the
+call goes back into the queue at its priority. Calls made with the same `key`
+while one is in flight share that call's result.
+
+    pool = ModelScheduler(max_concurrency=4, rate_per_s=2, burst=4)
+    await pool.run(lambda: client.aio.models.generate_content(...), priority="urgent", key=cache_key)
+"""
+import re
+import time
+import heapq
+import asyncio
+import itertools
+
+from model_pool import ModelPool, ClientDisconnectedError
+from metrics import queue_wait, coalesced_calls
+
+PRIORITIES = {"urgent": 0, "analysis": 1, "fillin": 2, "batch": 3}
+DEFAULT_PRIORITY = "fillin"
+
+
+def priority_class(priority):
+    return priority if priority in PRIORITIES else DEFAULT_PRIORITY
+
+
+#---------- RATE LIMIT ---------------#
+def is_rate_limited(error):
+    return getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429
+
+
+def retry_after_s(error):
+    """Server-suggested wait of a 429: the Retry-After header or the RetryInfo detail of the error body."""
+    response = getattr(error, "response", None)
+    header = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    body = getattr(error, "details", None)
+    details = body.get("error", {}).get("details", []) if isinstance(body, dict) else []
+    for detail in details:
+        m = re.fullmatch(r"(\d+(?:\.\d+)?)s", str(detail.get("retryDelay", "")))
+        if m:
+            return float(m.group(1))
+    return None
+
+
+class TokenBucket:
+    """`rate_per_s` calls per second with bursts of up to `burst`; rate <= 0 disables it."""
+
+    def __init__(self, rate_per_s=0.0, burst=1, backoff_s=1.0, max_backoff_s=60.0):
+        self.rate = rate_per_s
+        self.burst = max(1, burst)
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._strikes = 0   # consecutive 429s
+
+    def delay(self, now):
+        """Seconds until a call may start (0 = now)."""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.rate <= 0:
+            return 0.0
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self):
+        if self.rate > 0:
+            self._tokens -= 1
+
+    def rate_limited(self, retry_after=None):
+        """The API answered 429: stop handing out calls for a while."""
+        self._strikes += 1
+        if retry_after is None:
+            retry_after = self.backoff_s * 2 ** (self._strikes - 1)
+        wait = min(retry_after, self.max_backoff_s)
+        self._paused_until = max(self._paused_until, time.monotonic() + wait)
+        self._tokens = 0.0
+        return wait
+
+    def succeeded(self):
+        self._strikes = 0
+
+    @property
+    def paused_s(self):
+        return max(0.0, self._paused_until - time.monotonic())
+
+
+#---------- SCHEDULER ---------------#
+class ModelScheduler(ModelPool):
+    def __init__(self, max_concurrency=4, max_queue=16, timeout_s=60.0, disconnect_poll_s=0.5,
+                 rate_per_s=0.0, burst=1, max_rate_limit_retries=2, backoff_s=1.0, max_backoff_s=60.0):
+        super().__init__(max_concurrency, max_queue, timeout_s, disconnect_poll_s)
+        self.bucket = TokenBucket(rate_per_s, burst, backoff_s, max_backoff_s)
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self._free = max_concurrency
+        self._waiters = []   # heap of [priority, seq, future, class]
+        self._seq = itertools.count()
+        self._timer = None
+        self._flights = {}   # key -> [task, waiter count]
+        self.class_stats = {
+            name: {"queued": 0, "granted": 0, "wait_s_total": 0.0, "wait_s_max": 0.0, "coalesced": 0, "rate_limited": 0}
+            for name in PRIORITIES
+        }
+
+    @property
+    def stats(self):
+        return {
+            **super().stats,
+            "rate_per_s": self.bucket.rate,
+            "paused_s": round(self.bucket.paused_s, 3),
+            "in_flight_keys": len(self._flights),
+            "classes": self.class_stats,
+        }
+
+    #---------- SLOTS ---------------#
+    async def _acquire(self, priority=DEFAULT_PRIORITY, **options):
+        priority = priority_class(priority)
+        stats = self.class_stats[priority]
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self._waiters, [PRIORITIES[priority], next(self._seq), future, priority])
+        stats["queued"] += 1
+        queued_at = loop.time()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()   # granted just as we were cancelled: hand the slot on
+            else:
+                future.cancel()   # _dispatch drops cancelled entries
+            raise
+        finally:
+            stats["queued"] -= 1
+        waited = loop.time() - queued_at
+        stats["granted"] += 1
+        stats["wait_s_total"] += waited
+        stats["wait_s_max"] = max(stats["wait_s_max"], waited)
+        queue_wait.observe(waited, priority=priority)
+
+    def _release(self, **options):
+        self._free += 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to the highest-priority waiters the token bucket lets through."""
+        loop = asyncio.get_running_loop()
+        while self._waiters and self._free > 0:
+            if self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = self.bucket.delay(time.monotonic())
+            if delay > 0:
+                if self._timer is None:
+                    self._timer = loop.call_later(delay, self._wake)
+                return
+            _, _, future, _ = heapq.heappop(self._waiters)
+            self.bucket.take()
+            self._free -= 1
+            future.set_result(None)
+
+    def _wake(self):
+        self._timer = None
+        self._dispatch()
+
+    async def _run_in_slot(self, call_factory, priority=DEFAULT_PRIORITY, **options):
+        for attempt in range(self.max_rate_limit_retries + 1):
+            await self._acquire(priority=priority)
+            self._running += 1
+            try:
+                result = await call_factory()
+                self.bucket.succeeded()
+                return result
+            except Exception as e:
+                if not is_rate_limited(e):
+                    raise
+                self.class_stats[priority_class(priority)]["rate_limited"] += 1
+                self.bucket.rate_limited(retry_after_s(e))
+                if attempt == self.max_rate_limit_retries:
+                    raise
+                # back into the queue at the same priority; the bucket holds everyone until the pause ends
+            finally:
+                self._running -= 1
+                self._release()
+
+    #---------- CALLS ---------------#
+    async def run(self, call_factory, request=None, timeout_s=None, key=None, priority=DEFAULT_PRIORITY, **options):
+        """
+        ModelPool.run() with a priority class. Calls with the same `key` made while
+        one is in flight wait for that call instead of making their own; the shared
+        call is cancelled only once every caller has gone.
+        """
+        if key is None:
+            return await super().run(call_factory, request=request, timeout_s=timeout_s, priority=priority, **options)
+
+        flight = self._flights.get(key)
+        if flight is None:
+            self.check_capacity()
+            task = asyncio.ensure_future(super().run(call_factory, timeout_s=timeout_s, priority=priority, **options))
+            flight = self._flights[key] = [task, 0]
+
+            def landed(_):
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            task.add_done_callback(landed)
+        else:
+            self.class_stats[priority_class(priority)]["coalesced"] += 1
+            coalesced_calls.inc(priority=priority_class(priority))
+        flight[1] += 1
+
+        task = flight[0]
+        watch_task = asyncio.ensure_future(self._watch_disconnect(request)) if request is not None else None
+        try:
+            waiting = {task} if watch_task is None else {task, watch_task}
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            if task in done:
+                return task.result()
+            raise ClientDisconnectedError("client disconnected")
+        finally:
+            if watch_task is not None:
+                watch_task.cancel()
+            flight[1] -= 1
+            if flight[1] == 0 and not task.done():
+                # forget the key now, not in the done callback: a caller arriving in between
+                # would join a cancelled task
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                task.cancel()
+
+    async def stream(self, stream_factory, timeout_s=None, priority=DEFAULT_PRIORITY, **options):
+        """ModelPool.stream() with a priority class; a 429 pauses the bucket (streams are not retried)."""
+        try:
+            async for chunk in super().stream(stream_factory, timeout_s=timeout_s, priority=priority, **options):
+                yield chunk
+        except Exception as e:
+            if is_rate_limited(e):
+                self.class_stats[priority_class(priority)]["rate_limited"] += 1
+                self.bucket.rate_limited(retry_after_s(e))
+            raise
+        else:
+            self.bucket.succeeded()
@@ -0,0 +1,317 @@
+"""
+Pydantic models of the model's JSON output, plus the local repair pass.
+
+The models are passed to Gemini as `response_schema` (enums become schema enums),
+and every answer goes through repair_* (cheap, deterministic fixes for near-miss
+values) and then a single model_validate(). Fields that still fail are reported
+by failing_paths(), so a retry can ask for just those fields (see partial_model()).
+"""
+import re
+import datetime
+from typing import Literal, Optional, Annotated, get_args, get_origin
+from functools import lru_cache
+
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, create_model
+
+SCHEMA_VERSION = "2"   # part of the response cache keys; bump when the models change
+TASK_DUE_TZ = datetime.timezone(datetime.timedelta(hours=7))   # the prompt asks for +07:00
+
+
+#---------- FILL-IN ---------------#
+LocationPrimary = Literal["toe", "sole", "side", "heel", "dorsal_aspect", "medial_malleolus", "lateral_malleolus"]
+Shape = Literal["round", "oval", "irregular", "linear", "punched_out"]
+DepthCategory = Literal["superficial", "partial_thickness", "full_thickness", "deep", "very_deep_exposed_bone_tendon"]
+EdgeDescription = Literal["smooth", "thickened", "irregular", "rolled_epibole", "undermined", "calloused"]
+PeriwoundStatus = Literal["normal", "erythematous", "edematous", "indurated", "macerated", "fluctuant", "hyperpigmented"]
+DischargeVolume = Literal["none", "minimal", "moderate", "heavy"]
+DischargeType = Literal["serous (clear)", "sanguineous (bloody)", "serosanguineous (pink)", "purulent (yellow/pus)", "seropurulent (cloudy yellow)"]
+OdorPresence = Literal["none", "faint", "moderate", "foul", "putrid"]
+SkinCondition = Literal["healthy", "dry", "cracked", "macerated", "fragile", "scaling"]
+
+
+class FillIn(BaseModel):
+    location_primary: LocationPrimary
+    location_detail: str
+    wound_type: str
+    shape: Shape
+    size_width_cm: float = Field(ge=0)
+    size_length_cm: float = Field(ge=0)
+    depth_category: DepthCategory
+    bed_slough_pct: int = Field(ge=0, le=100)
+    bed_necrotic_pct: int = Field(ge=0, le=100)
+    edge_description: EdgeDescription
+    periwound_status: PeriwoundStatus
+    discharge_volume: DischargeVolume
+    discharge_type: DischargeType
+    odor_presence: OdorPresence
+    pain_score: int = Field(ge=0, le=10)
+    has_infection: bool
+    skin_condition: SkinCondition
+
+
+#---------- WOUND ANALYSIS ---------------#
+WoundStage = Literal["STAGE 1", "STAGE 2", "STAGE 3", "STAGE 4", "STAGE 5", "STAGE 6"]
+
+
+class AIAnalysis(BaseModel):
+    creator: str = "Gemini AI"
+    wound_stage: WoundStage
+    description: str
+    diagnosis: str
+    confidence: Optional[float] = Field(default=None, ge=0, le=1)   # the prompt allows null for unknown numbers
+    treatment_plan: str
+
+
+class PlanTask(BaseModel):
+    task_text: str
+    status: str = "DRAFT"
+    task_due: str = Field(pattern=r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\+07:00$")
+
+
+class TreatmentPlan(BaseModel):
+    plan_text: str
+    followup_days: Optional[int] = Field(default=None, ge=0)
+    status: str = "DRAFT"
+    plan_tasks: list[PlanTask]
+
+
+class WoundAnalysis(BaseModel):
+    AI_analysis: AIAnalysis
+    treatment_plan: TreatmentPlan
+
+
+#---------- REPAIR ---------------#
+def _enum_key(value):
+    value = re.sub(r"\(.*?\)", "", str(value)).strip().lower()
+    return re.sub(r"[\s\-/]+", "_", value).strip("_")
+
+
+def _enum_options(annotation):
+    return annotation.__args__
+
+
+def repair_enum(value, options):
+    """Map near-misses ("Full thickness", "rolled", "Serous") onto an allowed value; unchanged if no match.
+
+    Only spelling variants and abbreviations are mapped. A more specific answer
+    ("deep exposed bone", "moderate to heavy") is not narrowed to the option it
+    starts with; it stays invalid and goes to the per-field retry.
+    """
+    if value in options or not isinstance(value, str):
+        return value
+    key = _enum_key(value)
+    by_key = {_enum_key(o): o for o in options}
+    if key in by_key:
+        return by_key[key]
+    # unique abbreviation: "rolled" -> "rolled_epibole", "very_deep" -> "very_deep_exposed_bone_tendon"
+    matches = [o for k, o in by_key.items() if key and k.startswith(key)]
+    return matches[0] if len(matches) == 1 else value
+
+
+def _number(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return value
+    m = re.search(r"-?\d+(?:\.\d+)?", str(value))   # "3.5 cm (estimated)" -> 3.5
+    return float(m.group()) if m else value
+
+
+def _clamp_int(value, low, high):
+    value = _number(value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(round(min(max(value, low), high)))
+    return value
+
+
+def _bool(value):
+    if isinstance(value, str) and value.strip().lower() in ("true", "yes", "1", "false", "no", "0"):
+        return value.strip().lower() in ("true", "yes", "1")
+    return value
+
+
+def repair_fillin(doc):
+    """Local fixes for a fill-in dict (a copy is returned)."""
+    doc = dict(doc)
+    if "discharge_volumn" in doc and "discharge_volume" not in doc:
+        doc["discharge_volume"] = doc.pop("discharge_volumn")
+    for name, field in FillIn.model_fields.items():
+        if name not in doc:
+            continue
+        if getattr(field.annotation, "__origin__", None) is Literal:
+            doc[name] = repair_enum(doc[name], _enum_options(field.annotation))
+    for name in ("size_width_cm", "size_length_cm"):
+        if name in doc:
+            value = _number(doc[name])
+            doc[name] = abs(value) if isinstance(value, (int, float)) else value
+    for name in ("bed_slough_pct", "bed_necrotic_pct"):
+        if name in doc:
+            doc[name] = _clamp_int(doc[name], 0, 100)
+    if "pain_score" in doc:
+        doc["pain_score"] = _clamp_int(doc["pain_score"], 0, 10)
+    if "has_infection" in doc:
+        doc["has_infection"] = _bool(doc["has_infection"])
+    return doc
+
+
+def repair_task_due(value):
+    """Any parseable date/time -> YYYY-MM-DDTHH:MM:SS+07:00 (date-only -> 09:00)."""
+    if not isinstance(value, str):
+        return value
+    text = value.strip().replace(" ", "T", 1)
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    try:
+        parsed = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return value
+    if len(text) == 10:
+        parsed = parsed.replace(hour=9)
+    parsed = parsed.replace(tzinfo=TASK_DUE_TZ) if parsed.tzinfo is None else parsed.astimezone(TASK_DUE_TZ)
+    return parsed.replace(microsecond=0).isoformat()
+
+
+def repair_analysis(doc):
+    """Local fixes for a wound analysis dict (a copy is returned)."""
+    doc = {**doc}
+    ai = doc.get("AI_analysis")
+    if isinstance(ai, dict):
+        ai = doc["AI_analysis"] = {**ai}
+        stage = ai.get("wound_stage")
+        if isinstance(stage, (str, int)) and not isinstance(stage, bool):
+            # "Stage 3" / "stage3" / 3 only; "Wagner 2" is a different scale and is left to the retry
+            m = re.fullmatch(r"\s*(?:stage[\s_]*)?([1-6])\s*", str(stage), re.IGNORECASE)
+            if m:
+                ai["wound_stage"] = f"STAGE {m.group(1)}"
+        confidence = _number(ai.get("confidence"))
+        if isinstance(confidence, (int, float)) and not isinstance(confidence, bool):
+            if 1 < confidence <= 100 and (confidence >= 2 or float(confidence).is_integer()):
+                confidence = confidence / 100   # "85" / "85%"; a 1.5 is no percentage and is left to the retry
+            ai["confidence"] = round(confidence, 2) if 0 <= confidence <= 1 else confidence
+        ai.setdefault("creator", "Gemini AI")
+
+    plan = doc.get("treatment_plan")
+    if isinstance(plan, dict):
+        plan = doc["treatment_plan"] = {**plan}
+        if "followup_days" in plan:
+            days = _number(plan["followup_days"])
+            plan["followup_days"] = int(round(max(days, 0))) if isinstance(days, (int, float)) and not isinstance(days, bool) else days
+        tasks = plan.get("plan_tasks")
+        if isinstance(tasks, list):
+            plan["plan_tasks"] = [
+                {**t, "task_due": repair_task_due(t.get("task_due"))} if isinstance(t, dict) else t
+                for t in tasks
+            ]
+    return doc
+
+
+#---------- VALIDATION ---------------#
+@lru_cache(maxsize=None)
+def _field_adapter(schema, keys):
+    """TypeAdapter of the field at `keys` (list indexes left out), constraints included; None if unknown."""
+    model, info = schema, None
+    for key in keys:
+        if not (isinstance(model, type) and issubclass(model, BaseModel)) or key not in model.model_fields:
+            return None
+        info = model.model_fields[key]
+        model = info.annotation
+        if get_origin(model) is list:
+            model = get_args(model)[0]
+    return TypeAdapter(Annotated[info.annotation, info]) if info is not None else None
+
+
+def repair_field(schema, repair, path, value):
+    """
+    (repaired value, valid) for one streamed field, e.g. ("AI_analysis.confidence", 85)
+    -> (0.85, True). The value goes through the document repair function inside a
+    skeleton document, then is checked against its field alone.
+    """
+    keys = [int(k) if k.isdigit() else k for k in path.split(".")]
+    doc = value
+    for key in reversed(keys):
+        doc = [doc] if isinstance(key, int) else {key: doc}
+    try:
+        doc = repair(doc)
+        for key in keys:
+            doc = doc[0] if isinstance(key, int) else doc[key]
+        value = doc
+    except (KeyError, IndexError, TypeError, AttributeError):
+        pass
+    adapter = _field_adapter(schema, tuple(k for k in keys if isinstance(k, str)))
+    if adapter is None:
+        return value, False
+    try:
+        adapter.validate_python(value)
+    except ValidationError:
+        return value, False
+    return value, True
+
+
+def failing_paths(error: ValidationError):
+    """
+    Top-level-or-section field paths that failed, e.g. ("shape",) or
+    ("AI_analysis", "wound_stage"); list items collapse to the list field.
+    """
+    paths = []
+    for e in error.errors():
+        path = []
+        for part in e["loc"]:
+            if isinstance(part, int):
+                break
+            path.append(part)
+        path = tuple(path[:2])
+        if path and path not in paths:
+            paths.append(path)
+    return paths
+
+
+def partial_model(model, paths, name=None):
+    """A model holding only `paths` of `model` (nested sections keep their nesting)."""
+    fields = {}
+    for head in dict.fromkeys(p[0] for p in paths):
+        field = model.model_fields[head]
+        rest = [p[1:] for p in paths if p[0] == head and len(p) > 1]
+        annotation = field.annotation
+        if rest and isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            annotation = partial_model(annotation, rest)
+        fields[head] = (annotation, field)
+    return create_model(name or f"{model.__name__}Fix", **{
+        k: (annotation, Field(**_constraints(field))) for k, (annotation, field) in fields.items()
+    })
+
+
+def _constraints(field):
+    kwargs = {}
+    for meta in field.metadata:
+        for attr in ("ge", "le", "pattern"):
+            if getattr(meta, attr, None) is not None:
+                kwargs[attr] = getattr(meta, attr)
+    return kwargs
+
+
+def pick(doc, paths):
+    """The values at `paths` in `doc` (missing ones omitted), nested like the document."""
+    picked = {}
+    for path in paths:
+        source, target = doc, picked
+        for key in path[:-1]:
+            source = source.get(key) if isinstance(source, dict) else None
+            target = target.setdefault(key, {})
+        if isinstance(source, dict) and path[-1] in source:
+            target[path[-1]] = source[path[-1]]
+    return picked
+
+
+def merge_fix(doc, fix):
+    """Overlay the fields of a retry answer onto the original document."""
+    merged = {**doc}
+    for key, value in fix.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_fix(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def describe_errors(error: ValidationError):
+    return "; ".join(f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in error.errors())
@@ -0,0 +1,483 @@
+"""
+CPU-only "similar wounds" index over an image corpus.
+
+Every image is reduced to a compact descriptor:
+  - a 64-bit difference hash (dHash) for near-duplicate detection,
+  - an HSV colour histogram and a gradient-orientation (texture) histogram, both
+    Hellinger-normalised and concatenated into one unit-length float32 vector.
+Descriptors live in NumPy arrays, so a top-k query is one matrix-vector product plus
+argpartition. The index is an .npz snapshot plus an append-only journal of additions,
+so adding an image never rewrites the whole file. Several processes can share one
+index directory: each one picks up the others' journal lines and snapshots before
+it queries or writes, and compaction merges what is on disk under a file lock.
+Identical bytes are indexed once; every further source is kept as a copy of that
+entry and reported by `duplicates` with distance 0.
+
+    python similarity_index.py build ../ai_engine/data --index .cache/similarity
+    python similarity_index.py query some_wound.jpg --index .cache/similarity -k 10
+    python similarity_index.py duplicates --index .cache/similarity --max-distance 6
+    python similarity_index.py bench --index .cache/similarity --size 50000
+"""
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import datetime
+import itertools
+import threading
+import contextlib
+
+import numpy as np
+from PIL import Image, ImageOps
+
+try:
+    import fcntl
+except ImportError:   # Windows: no cross-process lock, run one writer per index directory
+    fcntl = None
+
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+HUE_BINS, SAT_BINS, VAL_BINS = 12, 3, 3
+ORIENTATION_BINS, TEXTURE_GRID = 8, 2
+FEATURE_DIM = HUE_BINS * SAT_BINS * VAL_BINS + ORIENTATION_BINS * TEXTURE_GRID * TEXTURE_GRID
+COLOUR_WEIGHT = 0.7    # share of the similarity score that comes from colour vs texture
+
+DUPLICATE_DISTANCE = 6   # dHash bits; <= this is reported as a near-duplicate
+JOURNAL_COMPACT_EVERY = 1000
+
+# popcount of every byte value, for Hamming distances on packed hashes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+#---------- DESCRIPTORS ---------------#
+def _dhash(gray):
+    small = np.asarray(gray.resize((9, 8), Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def _colour_histogram(rgb):
+    hsv = np.asarray(rgb.convert("HSV"), dtype=np.uint16).reshape(-1, 3)
+    h = hsv[:, 0] * HUE_BINS // 256
+    s = hsv[:, 1] * SAT_BINS // 256
+    v = hsv[:, 2] * VAL_BINS // 256
+    hist = np.bincount((h * SAT_BINS + s) * VAL_BINS + v, minlength=HUE_BINS * SAT_BINS * VAL_BINS)
+    return hist.astype(np.float32)
+
+
+def _texture_histogram(gray):
+    g = np.asarray(gray, dtype=np.float32)
+    gx = np.zeros_like(g)
+    gy = np.zeros_like(g)
+    gx[:, 1:-1] = g[:, 2:] - g[:, :-2]
+    gy[1:-1, :] = g[2:, :] - g[:-2, :]
+    magnitude = np.hypot(gx, gy)
+    # unsigned orientation in [0, pi)
+    orientation = ((np.arctan2(gy, gx) % np.pi) / np.pi * ORIENTATION_BINS).astype(np.int64) % ORIENTATION_BINS
+
+    cells = []
+    rows = np.array_split(np.arange(g.shape[0]), TEXTURE_GRID)
+    cols = np.array_split(np.arange(g.shape[1]), TEXTURE_GRID)
+    for r in rows:
+        for c in cols:
+            cell_o = orientation[np.ix_(r, c)].ravel()
+            cell_m = magnitude[np.ix_(r, c)].ravel()
+            cells.append(np.bincount(cell_o, weights=cell_m, minlength=ORIENTATION_BINS))
+    return np.concatenate(cells).astype(np.float32)
+
+
+def _hellinger(hist):
+    total = hist.sum()
+    return np.sqrt(hist / total) if total > 0 else hist
+
+
+def describe_image(img):
+    """(dhash, feature vector) for a PIL image."""
+    img.draft("RGB", (128, 128))   # JPEG: decode at reduced scale
+    rgb = ImageOps.exif_transpose(img).convert("RGB")
+    rgb.thumbnail((64, 64), Image.Resampling.BILINEAR)
+    gray = rgb.convert("L")
+
+    colour = _hellinger(_colour_histogram(rgb))
+    texture = _hellinger(_texture_histogram(gray))
+    # each block has unit length, so the weights set how much each one can move the score
+    features = np.concatenate([colour * np.sqrt(COLOUR_WEIGHT), texture * np.sqrt(1 - COLOUR_WEIGHT)])
+    norm = np.linalg.norm(features)
+    if norm > 0:
+        features /= norm
+    return _dhash(gray), features.astype(np.float32)
+
+
+def describe_bytes(data):
+    with Image.open(io.BytesIO(data)) as img:
+        return describe_image(img)
+
+
+def hamming(hash_a, hashes):
+    """Bit distance between one 64-bit hash and an array of them."""
+    xor = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(hash_a))
+    return _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+#---------- INDEX ---------------#
+def _file_sig(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _without_copies(meta):
+    return {k: v for k, v in meta.items() if k != "copies"}
+
+
+class SimilarityIndex:
+    """
+    Image descriptors keyed by the sha256 of the image bytes, with the image's
+    metadata (source path, case, ...) and the metadata of any further copies of the
+    same bytes under "copies". Safe to share between threads and processes.
+    """
+
+    def __init__(self, index_dir=None):
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._ids = []
+        self._meta = []
+        self._positions = {}
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._features = np.zeros((0, FEATURE_DIM), dtype=np.float32)
+        self._size = 0
+        self._journal_entries = 0
+        self._snapshot_sig = None
+        self._journal_ino = None
+        self._journal_offset = 0
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+            self.refresh()
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, image_id):
+        with self._lock:
+            return image_id in self._positions
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                "images": self._size,
+                "feature_dim": FEATURE_DIM,
+                "memory_bytes": int(self._hashes[: self._size].nbytes + self._features[: self._size].nbytes),
+                "journal_entries": self._journal_entries,
+            }
+
+    #---------- PERSISTENCE ---------------#
+    def _paths(self):
+        return os.path.join(self.index_dir, "index.npz"), os.path.join(self.index_dir, "journal.ndjson")
+
+    @contextlib.contextmanager
+    def _disk_lock(self, exclusive=False):
+        """flock on the index directory: shared to read the files, exclusive to change them."""
+        if not self.index_dir or fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.index_dir, "lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield   # closing the file releases it
+
+    def refresh(self):
+        """Pick up what other processes wrote since the last look."""
+        with self._lock, self._disk_lock():
+            self._refresh()
+
+    def _refresh(self):
+        # caller holds self._lock and the disk lock; rows are merged, never dropped
+        if not self.index_dir:
+            return
+        snapshot_path, journal_path = self._paths()
+        sig = _file_sig(snapshot_path)
+        if sig != self._snapshot_sig:
+            if sig is not None:
+                with np.load(snapshot_path, allow_pickle=False) as snap:
+                    hashes, features = snap["hashes"], snap["features"]
+                    ids = [str(i) for i in snap["ids"]]
+                    meta = [json.loads(m) for m in snap["meta"]]
+                if features.shape[1] == FEATURE_DIM:
+                    self._append(ids, meta, hashes, features)
+            self._snapshot_sig = sig
+            # a new snapshot means the journal was compacted: read the current one from the start
+            self._journal_ino, self._journal_offset, self._journal_entries = None, 0, 0
+
+        sig = _file_sig(journal_path)
+        if sig is None:
+            self._journal_ino, self._journal_offset, self._journal_entries = None, 0, 0
+            return
+        if sig[0] != self._journal_ino:
+            self._journal_ino, self._journal_offset, self._journal_entries = sig[0], 0, 0
+        if sig[2] <= self._journal_offset:
+            return
+        with open(journal_path, "rb") as f:
+            f.seek(self._journal_offset)
+            chunk = f.read()
+        chunk = chunk[: chunk.rfind(b"\n") + 1]   # a half-written last line is read next time
+        self._journal_offset += len(chunk)
+        for line in chunk.splitlines():
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            self._journal_entries += 1
+            if len(row["features"]) != FEATURE_DIM:
+                continue
+            self._append([row["id"]], [row["meta"]], [int(row["dhash"], 16)], [row["features"]])
+
+    def save(self):
+        """Write a fresh snapshot of everything on disk and in memory, and empty the journal."""
+        if not self.index_dir:
+            return
+        snapshot_path, journal_path = self._paths()
+        with self._lock, self._disk_lock(exclusive=True):
+            # rows other processes (or the build CLI) wrote since we loaded go into the snapshot too
+            self._refresh()
+            n = self._size
+            tmp_path = snapshot_path + ".tmp.npz"
+            np.savez(
+                tmp_path,
+                ids=np.array(self._ids[:n], dtype=str),
+                meta=np.array([json.dumps(m, ensure_ascii=False) for m in self._meta[:n]], dtype=str),
+                hashes=self._hashes[:n],
+                features=self._features[:n],
+            )
+            os.replace(tmp_path, snapshot_path)
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+            self._snapshot_sig = _file_sig(snapshot_path)
+            self._journal_ino, self._journal_offset, self._journal_entries = None, 0, 0
+
+    def _append(self, ids, meta, hashes, features):
+        """Add rows; a row whose id is already indexed adds its meta as a copy. Returns the rows that changed."""
+        needed = self._size + len(ids)
+        if needed > len(self._hashes):
+            # grow by doubling so one-at-a-time adds stay amortised O(1)
+            capacity = max(needed, 2 * len(self._hashes), 64)
+            hashes_buf = np.zeros(capacity, dtype=np.uint64)
+            features_buf = np.zeros((capacity, FEATURE_DIM), dtype=np.float32)
+            hashes_buf[: self._size] = self._hashes[: self._size]
+            features_buf[: self._size] = self._features[: self._size]
+            self._hashes, self._features = hashes_buf, features_buf
+        changed = 0
+        for i, image_id in enumerate(ids):
+            pos = self._positions.get(image_id)
+            if pos is not None:
+                changed += self._add_copies(pos, meta[i])
+                continue
+            pos = self._size
+            self._hashes[pos] = np.uint64(hashes[i])
+            self._features[pos] = features[i]
+            self._ids.append(image_id)
+            self._meta.append(meta[i])
+            self._positions[image_id] = pos
+            self._size += 1
+            changed += 1
+        return changed
+
+    def _add_copies(self, pos, meta):
+        primary = self._meta[pos]
+        seen = [_without_copies(primary), *primary.get("copies", [])]
+        extra = []
+        for copy in (_without_copies(meta), *meta.get("copies", [])):
+            if copy not in seen:
+                seen.append(copy)
+                extra.append(copy)
+        if not extra:
+            return 0
+        # replaced, not mutated: query results handed out earlier keep their dict
+        self._meta[pos] = {**primary, "copies": [*primary.get("copies", []), *extra]}
+        return 1
+
+    #---------- WRITES ---------------#
+    def add(self, data, meta=None):
+        """Index one image (bytes); identical bytes are described once and kept as a copy. Returns the image id."""
+        image_id = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            pos = self._positions.get(image_id)
+            known = None if pos is None else (int(self._hashes[pos]), self._features[pos].copy())
+        dhash, features = known or describe_bytes(data)
+        self.add_descriptor(image_id, dhash, features, meta)
+        return image_id
+
+    def add_descriptor(self, image_id, dhash, features, meta=None):
+        meta = {**(meta or {}), "added_at": datetime.datetime.now().isoformat(timespec="seconds")}
+        with self._lock, self._disk_lock(exclusive=True):
+            self._refresh()
+            if not self._append([image_id], [meta], [dhash], [features]):
+                return
+            if self.index_dir:
+                row = {"id": image_id, "meta": meta, "dhash": f"{dhash:016x}", "features": [round(float(x), 6) for x in features]}
+                line = (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+                with open(self._paths()[1], "ab") as f:
+                    f.write(line)
+                # nobody else can append while we hold the lock, so the journal is read up to here
+                self._journal_ino = _file_sig(self._paths()[1])[0]
+                self._journal_offset += len(line)
+                self._journal_entries += 1
+        if self._journal_entries >= JOURNAL_COMPACT_EVERY:
+            self.save()
+
+    #---------- QUERIES ---------------#
+    def query(self, dhash, features, k=10, exclude_id=None):
+        """Top-k most similar images, best first."""
+        with self._lock:
+            with self._disk_lock():
+                self._refresh()
+            # a snapshot: add() only writes rows >= n (or into a new buffer when it grows),
+            # so these views stay consistent without holding the lock while scoring
+            n = self._size
+            hashes = self._hashes[:n]
+            matrix = self._features[:n]
+            ids, meta = self._ids[:n], self._meta[:n]
+            excluded = self._positions.get(exclude_id) if exclude_id is not None else None
+        if n == 0:
+            return []
+
+        scores = matrix @ features
+        if excluded is not None:
+            scores[excluded] = -np.inf
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        distances = hamming(dhash, hashes[top])
+        return [
+            {
+                "image_id": ids[i],
+                "score": round(float(scores[i]), 4),
+                "hash_distance": int(d),
+                "near_duplicate": bool(d <= DUPLICATE_DISTANCE),
+                "meta": meta[i],
+            }
+            for i, d in zip(top, distances)
+            if np.isfinite(scores[i])
+        ]
+
+    def query_bytes(self, data, k=10):
+        dhash, features = describe_bytes(data)
+        return self.query(dhash, features, k=k, exclude_id=hashlib.sha256(data).hexdigest())
+
+    def duplicates(self, max_distance=DUPLICATE_DISTANCE, cells_per_block=4_000_000):
+        """
+        Pairs of images whose dHashes differ in at most `max_distance` bits, as
+        ({"image_id", "meta"}, {"image_id", "meta"}, distance); copies of the same
+        bytes come first, with distance 0.
+        """
+        with self._lock:
+            with self._disk_lock():
+                self._refresh()
+            n = self._size
+            hashes = self._hashes[:n]
+            ids, meta = self._ids[:n], self._meta[:n]
+
+        pairs = []
+        for image_id, m in zip(ids, meta):
+            entries = [{"image_id": image_id, "meta": c} for c in (_without_copies(m), *m.get("copies", []))]
+            pairs.extend((a, b, 0) for a, b in itertools.combinations(entries, 2))
+
+        block = max(1, cells_per_block // max(n, 1))
+        # blockwise all-pairs XOR: O(n^2) bit ops but vectorised and bounded in memory
+        for start in range(0, n, block):
+            a = hashes[start:start + block]
+            xor = np.bitwise_xor(a[:, None], hashes[None, :])
+            dist = _POPCOUNT[xor.view(np.uint8)].reshape(len(a), n, 8).sum(axis=2)
+            rows, cols = np.nonzero(dist <= max_distance)
+            for r, c in zip(rows, cols):
+                i = start + r
+                if i < c:
+                    pairs.append((
+                        {"image_id": ids[i], "meta": _without_copies(meta[i])},
+                        {"image_id": ids[c], "meta": _without_copies(meta[c])},
+                        int(dist[r, c]),
+                    ))
+        return sorted(pairs, key=lambda p: p[2])
+
+
+#---------- CLI ---------------#
+def _describe_file(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return hashlib.sha256(data).hexdigest(), describe_bytes(data)
+
+
+def build(index, root):
+    from concurrent.futures import ProcessPoolExecutor
+
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.join(dirpath, name))
+    paths.sort()
+
+    started = time.perf_counter()
+    added = 0
+    with ProcessPoolExecutor() as executor:
+        for path, (image_id, (dhash, features)) in zip(paths, executor.map(_describe_file, paths, chunksize=16)):
+            added += image_id not in index
+            # a second file with the same bytes is recorded as a copy of the first
+            index._append([image_id], [{"source": os.path.relpath(path, root)}], [dhash], [features])
+    index.save()
+    print(f"indexed {added} new images ({len(index)} total) in {time.perf_counter() - started:.1f}s")
+
+
+def bench(index, size, queries=200, k=10):
+    """Top-k latency against an index padded with random descriptors up to `size` images."""
+    rng = np.random.default_rng(0)
+    padded = SimilarityIndex()
+    padded._append(index._ids[: len(index)], index._meta[: len(index)], index._hashes[: len(index)], index._features[: len(index)])
+    extra = max(0, size - len(padded))
+    features = rng.random((extra, FEATURE_DIM), dtype=np.float32)
+    features /= np.linalg.norm(features, axis=1, keepdims=True)
+    hashes = rng.integers(0, 2**63, size=extra, dtype=np.int64).astype(np.uint64)
+    padded._append([f"random-{i}" for i in range(extra)], [{}] * extra, hashes, features)
+
+    timings = []
+    for i in range(queries):
+        q = padded._features[i % len(padded)]
+        started = time.perf_counter()
+        padded.query(int(padded._hashes[i % len(padded)]), q, k=k)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings = np.array(timings)
+    print(f"{len(padded)} images, top-{k}: p50 {np.percentile(timings, 50):.2f} ms, "
+          f"p95 {np.percentile(timings, 95):.2f} ms, max {timings.max():.2f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Similar-wound image index")
+    parser.add_argument("command", choices=["build", "query", "duplicates", "bench"])
+    parser.add_argument("path", nargs="?", help="image directory (build) or image file (query)")
+    parser.add_argument("--index", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "similarity"))
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--max-distance", type=int, default=DUPLICATE_DISTANCE)
+    parser.add_argument("--size", type=int, default=50_000, help="index size to benchmark (padded with random descriptors)")
+    args = parser.parse_args(argv)
+
+    index = SimilarityIndex(args.index)
+    if args.command == "build":
+        build(index, args.path)
+    elif args.command == "query":
+        with open(args.path, "rb") as f:
+            for hit in index.query_bytes(f.read(), k=args.k):
+                print(f"{hit['score']:.4f}  d={hit['hash_distance']:<2}  {hit['meta'].get('source', hit['image_id'])}")
+    elif args.command == "duplicates":
+        for a, b, d in index.duplicates(args.max_distance):
+            print(f"d={d:<2} {a['meta'].get('source', a['image_id'])}  {b['meta'].get('source', b['image_id'])}")
+    else:
+        bench(index, args.size, k=args.k)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+import os
+import re
+import sys
+import sqlite3
+import threading
+from datetime import date
+
+from data_tables import TABLE_SCHEMAS, DataTables, read_table_csv
+
+
+#---------- SCHEMA ---------------#
+# Columns and types come from the CSV schemas in data_tables.py (including the
+# historic spellings `urgentcy`, `size_legnth_cm`, `discharge_volumn`).
+TABLE_COLUMNS = {table: list(schema) for table, schema in TABLE_SCHEMAS.items()}
+
+# Everything else is stored as TEXT
+NUMERIC_COLUMNS = {
+    column
+    for schema in TABLE_SCHEMAS.values()
+    for column, dtype in schema.items()
+    if dtype in ("Float64", "boolean")
+}
+
+INDEXES = [
+    ("patients", "patient_id", True),
+    ("wound_cases", "record_id", False),
+    ("wound_cases", "case_id", False),
+    ("wound_cases", "patient_id", False),
+    ("wound_cases", "latest_image_id", False),
+    ("ai_analysis", "analysis_id", False),
+    ("ai_analysis", "record_id", False),
+    ("treatment_plan", "plan_id", False),
+    ("treatment_plan", "case_id", False),
+    ("plan_task", "task_id", False),
+    ("plan_task", "plan_id", False),
+]
+
+# Running number per (prefix, YYMM), e.g. PT-2601-00042
+ID_PATTERN = re.compile(r"^([A-Z]+)-(\d{4})-(\d+)$")
+
+
+def _schema_sql():
+    statements = []
+    for table, columns in TABLE_COLUMNS.items():
+        cols = ", ".join(f"{c} {'NUMERIC' if c in NUMERIC_COLUMNS else 'TEXT'}" for c in columns)
+        statements.append(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY AUTOINCREMENT, {cols})")
+    for table, column, unique in INDEXES:
+        statements.append(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS idx_{table}_{column} ON {table} ({column})"
+        )
+    statements.append(
+        "CREATE TABLE IF NOT EXISTS id_sequence (prefix TEXT NOT NULL, period TEXT NOT NULL, "
+        "value INTEGER NOT NULL, PRIMARY KEY (prefix, period))"
+    )
+    # bumped by every write transaction, so other processes can tell their copies are stale
+    statements.append("CREATE TABLE IF NOT EXISTS write_version (id INTEGER PRIMARY KEY CHECK (id = 1), value INTEGER NOT NULL)")
+    statements.append("INSERT OR IGNORE INTO write_version (id, value) VALUES (1, 0)")
+    return statements
+
+
+#---------- STORE ---------------#
+class Store:
+    """
+    SQLite (WAL mode) storage for patients, wound_cases, ai_analysis, treatment_plan
+    and plan_task.
+
+    Each thread gets its own connection; writes are short IMMEDIATE transactions, so
+    several uvicorn workers can share one database file safely.
+
+    Every write transaction bumps a version number (version()). Listeners added with
+    add_listener(fn) are called as fn(version, writes) once the transaction has
+    committed, where writes lists (table, row, old) for every inserted / updated row
+    (old is None for inserts). Writes from other processes reach no listener; they
+    show up as a version that skipped ahead.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._listeners = []
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._transaction() as conn:
+            for statement in _schema_sql():
+                conn.execute(statement)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")   # durable at checkpoints, crash-safe in WAL mode
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self)
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def _written(self, table, row, old=None):
+        # queued until COMMIT so listeners never see rolled-back rows
+        self._local.written.append((table, row, old))
+
+    def _notify(self, version, written):
+        for fn in self._listeners:
+            fn(version, written)
+
+    #---------- IDS ---------------#
+    def _next_id(self, conn, prefix, today=None):
+        period = (today or date.today()).strftime("%y%m")
+        value = conn.execute(
+            "INSERT INTO id_sequence (prefix, period, value) VALUES (?, ?, 1) "
+            "ON CONFLICT (prefix, period) DO UPDATE SET value = value + 1 RETURNING value",
+            (prefix, period),
+        ).fetchone()[0]
+        return f"{prefix}-{period}-{value:05d}"
+
+    def next_id(self, prefix, today=None):
+        with self._transaction() as conn:
+            return self._next_id(conn, prefix, today)
+
+    def _bump_sequences(self, conn, ids):
+        # make sure freshly allocated ids never collide with imported ones
+        highest = {}
+        for value in ids:
+            m = ID_PATTERN.match(str(value))
+            if m:
+                key = (m.group(1), m.group(2))
+                highest[key] = max(highest.get(key, 0), int(m.group(3)))
+        for (prefix, period), value in highest.items():
+            conn.execute(
+                "INSERT INTO id_sequence (prefix, period, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (prefix, period) DO UPDATE SET value = MAX(value, excluded.value)",
+                (prefix, period, value),
+            )
+
+    #---------- WRITES ---------------#
+    def _insert(self, conn, table, row):
+        columns = [c for c in TABLE_COLUMNS[table] if c in row]
+        conn.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+            [row[c] for c in columns],
+        )
+        self._written(table, {c: row[c] for c in columns})
+
+    def insert(self, table, row):
+        with self._transaction() as conn:
+            self._insert(conn, table, row)
+
+    def insert_many(self, table, rows):
+        with self._transaction() as conn:
+            for row in rows:
+                self._insert(conn, table, row)
+
+    def create_patient(self, record, prefix="PT"):
+        """Allocate the next PT-YYMM-NNNNN id and insert the patient in one transaction."""
+        with self._transaction() as conn:
+            patient_id = self._next_id(conn, prefix)
+            self._insert(conn, "patients", {**record, "patient_id": patient_id})
+        return patient_id
+
+    def update(self, table, key_column, key, values):
+        """Update the latest row where key_column == key; returns the new row, or None if there is none."""
+        columns = [c for c in TABLE_COLUMNS[table] if c in values]
+        with self._transaction() as conn:
+            old = conn.execute(
+                f"SELECT * FROM {table} WHERE {key_column} = ? ORDER BY id DESC LIMIT 1", (key,)
+            ).fetchone()
+            if old is None:
+                return None
+            old = dict(old)
+            conn.execute(
+                f"UPDATE {table} SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?",
+                [values[c] for c in columns] + [old["id"]],
+            )
+            new = {**old, **{c: values[c] for c in columns}}
+            self._written(table, new, old)
+        return new
+
+    def create_case(self, record, analysis=None, plan=None, tasks=()):
+        """
+        Insert a wound_cases record with its ai_analysis, treatment_plan and plan_task
+        rows in one transaction; REC / CASE / AN / PLAN / TASK ids are allocated here.
+        Returns the allocated ids.
+        """
+        with self._transaction() as conn:
+            ids = {
+                "record_id": self._next_id(conn, "REC"),
+                "case_id": record.get("case_id") or self._next_id(conn, "CASE"),
+            }
+            self._insert(conn, "wound_cases", {**record, **ids})
+            if analysis is not None:
+                ids["analysis_id"] = self._next_id(conn, "AN")
+                self._insert(conn, "ai_analysis", {**analysis, "analysis_id": ids["analysis_id"], "record_id": ids["record_id"]})
+            if plan is not None:
+                ids["plan_id"] = self._next_id(conn, "PLAN")
+                self._insert(conn, "treatment_plan", {**plan, "plan_id": ids["plan_id"], "case_id": ids["case_id"]})
+                ids["task_ids"] = []
+                for task in tasks:
+                    task_id = self._next_id(conn, "TASK")
+                    self._insert(conn, "plan_task", {**task, "task_id": task_id, "plan_id": ids["plan_id"]})
+                    ids["task_ids"].append(task_id)
+        return ids
+
+    #---------- READS ---------------#
+    def find(self, table, **where):
+        clause = " AND ".join(f"{c} = ?" for c in where) or "1 = 1"
+        rows = self._connect().execute(
+            f"SELECT * FROM {table} WHERE {clause} ORDER BY id", list(where.values())
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    @staticmethod
+    def _count(conn, table):
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def count(self, table):
+        return self._count(self._connect(), table)
+
+    def version(self):
+        return self._connect().execute("SELECT value FROM write_version").fetchone()[0]
+
+    def read_tables(self, tables):
+        """(version, {table: rows}) read in one transaction, so the rows match the version."""
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            version = conn.execute("SELECT value FROM write_version").fetchone()[0]
+            rows = {table: [dict(r) for r in conn.execute(f"SELECT * FROM {table} ORDER BY id")] for table in tables}
+        finally:
+            conn.execute("COMMIT")
+        return version, rows
+
+    #---------- CSV IMPORT ---------------#
+    def import_csv(self, table, csv_path):
+        """One-shot import of a mockup_data CSV, parsed with its typed schema."""
+        return self.import_frame(table, read_table_csv(table, csv_path))
+
+    def import_frame(self, table, df):
+        """Insert the rows of a typed table (data_tables schema)."""
+        with self._transaction() as conn:
+            return self._import_frame(conn, table, df)
+
+    def _import_frame(self, conn, table, df):
+        # pandas NA / categories / nullable numbers -> plain Python values for sqlite3
+        df = df.astype(object).where(df.notna(), None)
+        rows = [
+            {c: (int(v) if isinstance(v, bool) else v) for c, v in r.items()}
+            for r in df.to_dict("records")
+        ]
+        for row in rows:
+            self._insert(conn, table, row)
+        id_column = TABLE_COLUMNS[table][0]
+        self._bump_sequences(conn, (r.get(id_column) for r in rows))
+        return len(rows)
+
+    def import_mockup_data(self, tables, only_if_empty=False):
+        """
+        Seed empty tables from a DataTables (or a mockup_data directory); tables that
+        already hold data are left alone, so re-running the import is harmless. With
+        only_if_empty nothing is imported unless the whole database is empty.
+
+        The emptiness checks and the inserts share one IMMEDIATE transaction, so
+        several workers seeding the same fresh file import it exactly once.
+        """
+        if not isinstance(tables, DataTables):
+            tables = DataTables(tables)
+        # read the files before taking the write lock; only tables that look empty
+        frames = {
+            table: tables.get(table)
+            for table in TABLE_COLUMNS
+            if tables.exists(table) and self.count(table) == 0
+        }
+        imported = {}
+        with self._transaction() as conn:
+            counts = {table: self._count(conn, table) for table in TABLE_COLUMNS}
+            if only_if_empty and any(counts.values()):
+                return imported   # another worker got here first
+            for table, df in frames.items():
+                if counts[table] == 0:
+                    imported[table] = self._import_frame(conn, table, df)
+        return imported
+
+    def is_empty(self):
+        return all(self.count(table) == 0 for table in TABLE_COLUMNS)
+
+
+class _Transaction:
+    def __init__(self, store):
+        self.store = store
+        self.conn = store._connect()
+
+    def __enter__(self):
+        # IMMEDIATE takes the write lock up front, so id allocation + insert can't interleave
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.store._local.written = []
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        written, self.store._local.written = self.store._local.written, []
+        if exc_type:
+            self.conn.execute("ROLLBACK")
+            return False
+        version = None
+        if written:
+            version = self.conn.execute("UPDATE write_version SET value = value + 1 RETURNING value").fetchone()[0]
+        self.conn.execute("COMMIT")
+        if written:
+            self.store._notify(version, written)
+        return False
+
+
+if __name__ == "__main__":
+    # Usage: python storage.py <db_path> <mockup_data_dir>
+    if len(sys.argv) != 3:
+        print("usage: python storage.py <db_path> <mockup_data_dir>")
+        sys.exit(1)
+    store = Store(sys.argv[1])
+    imported = store.import_mockup_data(sys.argv[2])
+    for table in TABLE_COLUMNS:
+        if table in imported:
+            print(f"imported {imported[table]} rows into {table}")
+        else:
+            print(f"skipped {table} (already has data or no CSV)")
@@ -0,0 +1,31 @@
+from storage import Store
+from dashboard import Dashboard
+
+
+def _worker(path):
+    store, dashboard = Store(path), Dashboard()
+    store.add_listener(dashboard.on_commit)
+    dashboard.load(store)
+    return store, dashboard
+
+
+def test_workers_see_each_others_writes(tmp_path):
+    path = str(tmp_path / "foster.db")
+    (store_a, dashboard_a), (store_b, dashboard_b) = _worker(path), _worker(path)
+
+    store_a.create_case({"status": "NEW", "urgentcy": "urgent"}, analysis={"wound_stage": "STAGE 2"})
+    store_b.create_case({"status": "NEW", "urgentcy": "routine"})
+
+    etag_a, body_a = dashboard_a.snapshot()
+    etag_b, body_b = dashboard_b.snapshot()
+    assert etag_a == etag_b
+    assert body_a["by_urgency"] == body_b["by_urgency"] == {"urgent": 1, "routine": 1}
+    assert len(body_b["recent_analyses"]) == 1
+
+
+def test_own_writes_do_not_reload(tmp_path, monkeypatch):
+    store, dashboard = _worker(str(tmp_path / "foster.db"))
+    monkeypatch.setattr(store, "read_tables", lambda tables: (_ for _ in ()).throw(AssertionError("reloaded")))
+
+    store.create_case({"status": "NEW", "urgentcy": "urgent"})
+    assert dashboard.snapshot()[1]["cases"] == 1
@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from schemas import FillIn, repair_fillin, repair_enum, DepthCategory
+from analysis import validate, validate_output, InvalidModelOutput
+
+
+def test_repair_enum_maps_spelling_and_abbreviations():
+    assert repair_enum("Full thickness", DepthCategory.__args__) == "full_thickness"
+    assert repair_enum("very deep", DepthCategory.__args__) == "very_deep_exposed_bone_tendon"
+    doc = repair_fillin({"edge_description": "rolled", "discharge_type": "Serous", "discharge_volume": "Moderate"})
+    assert doc == {"edge_description": "rolled_epibole", "discharge_type": "serous (clear)", "discharge_volume": "moderate"}
+
+
+@pytest.mark.parametrize("field, value", [
+    ("depth_category", "deep exposed bone"),
+    ("discharge_type", "Serous-sanguineous"),
+    ("discharge_volume", "moderate to heavy"),
+    ("discharge_volume", "none/minimal"),
+    ("odor_presence", "f"),   # ambiguous: faint / foul
+])
+def test_repair_enum_leaves_more_specific_answers_invalid(field, value):
+    assert repair_fillin({field: value})[field] == value
+    _, error = validate(FillIn, repair_fillin({field: value}))
+    assert any(e["loc"] == (field,) for e in error.errors())
+
+
+def test_missing_text_part_is_retried_then_invalid():
+    asked = []
+
+    async def ask(schema, prompt):
+        asked.append(prompt)
+        return None   # candidates but no text part, e.g. a SAFETY finish
+
+    with pytest.raises(InvalidModelOutput):
+        asyncio.run(validate_output("fillin", FillIn, repair_fillin, None, ask))
+    assert asked
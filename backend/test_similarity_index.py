@@ -0,0 +1,35 @@
+import numpy as np
+
+from similarity_index import SimilarityIndex, FEATURE_DIM
+
+
+def _descriptor(seed):
+    features = np.random.default_rng(seed).random(FEATURE_DIM, dtype=np.float32)
+    return seed * 0x0101010101, features / np.linalg.norm(features)
+
+
+def test_save_merges_what_other_processes_wrote(tmp_path):
+    index_dir = str(tmp_path / "similarity")
+    worker_a, worker_b = SimilarityIndex(index_dir), SimilarityIndex(index_dir)
+    worker_a.add_descriptor("a", *_descriptor(1))
+    worker_b.add_descriptor("b", *_descriptor(2))
+
+    # the build CLI writes a snapshot while both workers run
+    cli = SimilarityIndex(index_dir)
+    cli.add_descriptor("c", *_descriptor(3))
+    cli.save()
+
+    worker_a.add_descriptor("d", *_descriptor(4))
+    worker_a.save()   # compaction must not drop b (other worker) or c (CLI)
+    assert {hit["image_id"] for hit in worker_b.query(*_descriptor(1), k=10)} == {"a", "b", "c", "d"}
+    assert len(SimilarityIndex(index_dir)) == 4
+
+
+def test_exact_copies_are_reported(tmp_path):
+    index = SimilarityIndex(str(tmp_path / "similarity"))
+    index.add_descriptor("x", *_descriptor(1), meta={"source": "one.jpg"})
+    index.add_descriptor("x", *_descriptor(1), meta={"source": "one (1).jpg"})
+    index.save()
+
+    pairs = SimilarityIndex(str(tmp_path / "similarity")).duplicates(max_distance=0)
+    assert [(a["meta"]["source"], b["meta"]["source"], d) for a, b, d in pairs] == [("one.jpg", "one (1).jpg", 0)]
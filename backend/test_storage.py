@@ -0,0 +1,48 @@
+import threading
+from datetime import date
+
+import pandas as pd
+
+from storage import Store
+
+
+def test_concurrent_registrations_get_unique_consecutive_ids(tmp_path):
+    path = str(tmp_path / "foster.db")
+    Store(path)
+    ids, errors = [], []
+    start = threading.Barrier(8)
+
+    def register(worker):
+        store = Store(path)   # its own connection, like another uvicorn worker
+        start.wait()
+        try:
+            for i in range(25):
+                ids.append(store.create_patient({"patient_name": f"P {worker}-{i}"}))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=register, args=(w,)) for w in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    period = date.today().strftime("%y%m")
+    assert sorted(ids) == [f"PT-{period}-{n:05d}" for n in range(1, 201)]
+    assert Store(path).count("patients") == 200
+
+
+def test_imported_ids_are_never_reissued(tmp_path):
+    store = Store(str(tmp_path / "foster.db"))
+    period = date.today().strftime("%y%m")
+    store.import_frame("patients", pd.DataFrame({
+        "patient_id": [f"PT-{period}-00007", f"PT-{period}-00003", "PT-2401-00099", "legacy-1"],
+        "patient_name": ["a", "b", "c", "d"],
+    }))
+
+    assert store.create_patient({"patient_name": "new"}) == f"PT-{period}-00008"
+    assert store.next_id("PT", today=date(2024, 1, 15)) == "PT-2401-00100"
+    # a later, lower import does not move the sequence back
+    store.import_frame("patients", pd.DataFrame({"patient_id": [f"PT-{period}-00002"], "patient_name": ["e"]}))
+    assert store.create_patient({"patient_name": "newer"}) == f"PT-{period}-00009"
@@ -0,0 +1,62 @@
+import io
+import hashlib
+
+from PIL import Image
+
+from storage import Store
+from blob_store import BlobStore
+from timeline import TimelineStore, case_records, visit_metrics, build_timeline
+
+
+def _write_png(path, colour):
+    out = io.BytesIO()
+    Image.new("RGB", (32, 24), colour).save(out, format="PNG")
+    with open(path, "wb") as f:
+        f.write(out.getvalue())
+    return hashlib.sha256(out.getvalue()).hexdigest()
+
+
+def test_timeline_joins_records_by_image(tmp_path):
+    case_dir = tmp_path / "cases" / "Case 1"
+    case_dir.mkdir(parents=True)
+    baseline = _write_png(case_dir / "Baseline.png", (200, 40, 40))
+    week = _write_png(case_dir / "Week 2.png", (180, 60, 60))
+    _write_png(case_dir / "Week 4.png", (160, 80, 80))   # no record for this one
+
+    store = Store(str(tmp_path / "foster.db"))
+    # recorded in the database under its own case id, in a different order than the folder
+    store.create_case(
+        {"case_id": "CASE-2610-00001", "latest_image_id": week, "size_width_cm": 2, "size_legnth_cm": 2,
+         "created_at": "2026-10-15T09:00:00"},
+        analysis={"wound_stage": "STAGE 2", "confidence": 0.7},
+    )
+    store.create_case({"case_id": "CASE-2610-00001", "latest_image_id": baseline, "size_width_cm": 4,
+                       "size_legnth_cm": 2, "created_at": "2026-10-01T09:00:00"})
+    store.create_case({"case_id": "CASE-2610-00001", "latest_image_id": None, "size_width_cm": 1,
+                       "size_legnth_cm": 1, "created_at": "2026-10-29T09:00:00"})
+
+    blob_store = BlobStore(str(tmp_path / "blobs"))
+    timeline_store = TimelineStore(str(tmp_path / "cases"), cache_dir=str(tmp_path / "cache"), blob_store=blob_store)
+    visits = timeline_store.visits("1")
+    records, analyses = case_records(store, "1", visits)
+    timeline = build_timeline("1", visits, visit_metrics(records, analyses), blob_store)
+
+    entries = {e["label"]: e for e in timeline["entries"]}
+    assert [e["label"] for e in timeline["entries"]] == ["Baseline", "Week 2", "Week 4"]
+    assert entries["Baseline"]["metrics"]["area_cm2"] == 8.0
+    assert entries["Week 2"]["metrics"]["wound_stage"] == "STAGE 2"
+    assert entries["Week 2"]["metrics"]["area_cm2"] == 4.0
+    assert entries["Week 4"]["metrics"] is None
+    # folder images are served from the blob store like uploads
+    assert entries["Baseline"]["image_url"] == f"/images/{baseline}"
+    assert entries["Baseline"]["thumbnails"]["thumb"] == f"/images/{baseline}/thumb"
+    assert blob_store.derivative(baseline, "thumb")[1] == "image/jpeg"
+
+    # by database case id: every record, the ones without a folder image as visits of their own
+    records, analyses = case_records(store, "CASE-2610-00001")
+    timeline = build_timeline("CASE-2610-00001", [], visit_metrics(records, analyses), blob_store)
+    assert timeline["visits"] == 3
+    assert [e["metrics"]["area_cm2"] for e in timeline["entries"]] == [8.0, 4.0, 1.0]
+    assert [e["metrics"]["area_change_pct"] for e in timeline["entries"]] == [0.0, -50.0, -87.5]
+    assert [e["day"] for e in timeline["entries"]] == [0, 14, 28]
+    assert [e["image_url"] for e in timeline["entries"]] == [f"/images/{baseline}", f"/images/{week}", None]
@@ -0,0 +1,254 @@
+"""
+Healing timeline of a case: its visit images in order, with thumbnails and metrics.
+
+A case is a folder of visit images named "Baseline", "Day N" or "Week N" (see
+mockup_data/Test cases) and/or the wound_cases records stored under its case id.
+Folder images go into the blob store like uploads, so every timeline image and its
+thumb / preview derivatives are served by /images/{blob id}. Image-derived data
+(blob id, size) is kept in a per-case manifest under the cache directory; a scan only
+processes files that are new or changed since the last one, so adding a week never
+touches the earlier weeks. Visits and records are joined by image content: a record's
+latest_image_id is the blob id (sha256) of the photo it documents.
+"""
+import os
+import re
+import json
+import datetime
+import threading
+
+from blob_store import DERIVATIVES, BlobNotFoundError
+
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+VISIT_PATTERN = re.compile(r"^(baseline|day|week)\s*(\d*)", re.IGNORECASE)
+
+# wound_cases / ai_analysis columns reported per visit
+CASE_METRICS = [
+    "size_width_cm", "size_legnth_cm", "bed_slough_pct", "bed_necrotic_pct", "depth_category",
+    "pain_score", "has_infection", "urgentcy", "status",
+]
+ANALYSIS_METRICS = ["wound_stage", "confidence", "healing_progress"]
+
+
+class CaseNotFoundError(KeyError):
+    """No image folder for this case id."""
+
+
+def visit_day(name):
+    """Days since baseline for "Baseline", "Day 12", "Week 3 (close-up)" ...; None if unknown."""
+    m = VISIT_PATTERN.match(name.strip())
+    if not m:
+        return None
+    kind, number = m.group(1).lower(), m.group(2)
+    if kind == "baseline" or not number:
+        return 0
+    return int(number) * 7 if kind == "week" else int(number)
+
+
+def _file_signature(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+class TimelineStore:
+    """
+    Visit manifests for the case folders under `cases_root` ("Case 1", "Case 2", ...),
+    whose images are kept in `blob_store`. Case ids are accepted as "1" or "Case 1".
+    """
+
+    def __init__(self, cases_root, cache_dir, blob_store):
+        self.cases_root = cases_root
+        self.cache_dir = os.path.join(cache_dir, "timeline")
+        self.blob_store = blob_store
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self.stats = {"scans": 0, "images_processed": 0, "images_reused": 0}
+
+    def case_dir(self, case_id):
+        for name in (str(case_id), f"Case {case_id}"):
+            path = os.path.join(self.cases_root, name)
+            # case ids come from the URL: never leave cases_root
+            if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.cases_root) and os.path.isdir(path):
+                return path
+        raise CaseNotFoundError(case_id)
+
+    def _case_lock(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _manifest_path(self, key):
+        return os.path.join(self.cache_dir, key, "manifest.json")
+
+    #---------- SCAN ---------------#
+    def visits(self, case_id):
+        """
+        Ordered visit entries of a case. Only images that are new or changed since the
+        manifest was written are decoded; everything else comes from the manifest.
+        """
+        case_dir = self.case_dir(case_id)
+        key = os.path.basename(case_dir)
+        with self._case_lock(key):
+            manifest_path = self._manifest_path(key)
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except (FileNotFoundError, ValueError):
+                manifest = {}
+
+            current = {}
+            changed = False
+            for name in os.listdir(case_dir):
+                if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                path = os.path.join(case_dir, name)
+                signature = _file_signature(path)
+                entry = manifest.get(name)
+                if entry is None or entry["signature"] != signature or not self.blob_store.exists(entry["sha256"]):
+                    entry = self._process(name, path, signature)
+                    changed = True
+                    self.stats["images_processed"] += 1
+                else:
+                    self.stats["images_reused"] += 1
+                current[name] = entry
+
+            if changed or current.keys() != manifest.keys():
+                os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+                tmp_path = f"{manifest_path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(current, f, ensure_ascii=False)
+                os.replace(tmp_path, manifest_path)
+            self.stats["scans"] += 1
+
+        return sorted(
+            current.values(),
+            key=lambda e: (e["day"] is None, e["day"] or 0, e["image"]),
+        )
+
+    def _process(self, name, path, signature):
+        with open(path, "rb") as f:
+            data = f.read()
+        blob_id = self.blob_store.put(data)   # derivatives are built in the background
+        info = self.blob_store.info(blob_id)
+        label = os.path.splitext(name)[0]
+        return {
+            "image": name,
+            "label": label,
+            "day": visit_day(label),
+            "sha256": blob_id,
+            "width": info["width"],
+            "height": info["height"],
+            "bytes": len(data),
+            "signature": signature,
+        }
+
+
+#---------- METRICS ---------------#
+def _area(record):
+    try:
+        return round(float(record["size_width_cm"]) * float(record["size_legnth_cm"]), 2)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _created(row):
+    try:
+        return datetime.datetime.fromisoformat(str(row["created_at"]))
+    except (TypeError, ValueError):
+        return None
+
+
+def case_records(store, case_id, visits=()):
+    """
+    (records, analyses) of a case: the wound_cases rows stored under `case_id` plus
+    those documenting one of the `visits` images, oldest first, with their ai_analysis rows.
+    """
+    records = {r["id"]: r for r in store.find("wound_cases", case_id=case_id)}
+    for visit in visits:
+        records.update((r["id"], r) for r in store.find("wound_cases", latest_image_id=visit["sha256"]))
+    # created_at order where it parses (imported CSV rows use other formats), insertion order otherwise
+    records = sorted(records.values(), key=lambda r: (_created(r) is None, _created(r) or datetime.datetime.min, r["id"]))
+    analyses = []
+    for record in records:
+        analyses += store.find("ai_analysis", record_id=record["record_id"])
+    return records, analyses
+
+
+def visit_metrics(records, analyses):
+    """
+    Per-visit metrics from the case's wound_cases records (oldest first) and their
+    ai_analysis rows; area change is relative to the first visit that has a size.
+    """
+    by_record = {}
+    for analysis in analyses:
+        by_record[analysis["record_id"]] = analysis   # latest analysis per record wins
+
+    metrics = []
+    baseline_area = None
+    for record in records:
+        row = {"record_id": record.get("record_id"), "image_id": record.get("latest_image_id"), "created_at": record.get("created_at")}
+        row.update({c: record.get(c) for c in CASE_METRICS})
+        analysis = by_record.get(record.get("record_id"), {})
+        row.update({c: analysis.get(c) for c in ANALYSIS_METRICS})
+        row["area_cm2"] = _area(record)
+        if baseline_area is None and row["area_cm2"]:
+            baseline_area = row["area_cm2"]
+        row["area_change_pct"] = (
+            round((row["area_cm2"] - baseline_area) / baseline_area * 100, 1)
+            if baseline_area and row["area_cm2"] is not None else None
+        )
+        metrics.append(row)
+    return metrics
+
+
+def image_urls(blob_id):
+    return {
+        "image_url": f"/images/{blob_id}",
+        "thumbnails": {variant: f"/images/{blob_id}/{variant}" for variant in DERIVATIVES},
+    }
+
+
+def build_timeline(case_id, visits, metrics, blob_store):
+    """
+    Folder visits (in visit order) get the metrics of the record showing the same
+    image; records without a folder image follow as visits of their own, dated in
+    days since the first of them.
+    """
+    by_image = {row["image_id"]: row for row in metrics if row["image_id"]}   # latest record per image wins
+    used = set()
+    entries = []
+    for visit in visits:
+        row = by_image.get(visit["sha256"])
+        if row is not None:
+            used.add(row["record_id"])
+        entries.append({
+            "visit": len(entries),
+            "label": visit["label"],
+            "day": visit["day"],
+            **image_urls(visit["sha256"]),
+            "width": visit["width"],
+            "height": visit["height"],
+            "sha256": visit["sha256"],
+            "metrics": row,
+        })
+
+    rest = [row for row in metrics if row["record_id"] not in used]
+    first = next((t for t in map(_created, rest) if t is not None), None)
+    for row in rest:
+        created = _created(row)
+        try:
+            # uploads from /create-case are in the blob store; imported records point at old image ids
+            info = blob_store.info(row["image_id"]) if row["image_id"] else None
+        except BlobNotFoundError:
+            info = None
+        entries.append({
+            "visit": len(entries),
+            "label": row["created_at"],
+            "day": (created - first).days if created and first else None,
+            **(image_urls(row["image_id"]) if info else {"image_url": None, "thumbnails": {}}),
+            "width": info["width"] if info else None,
+            "height": info["height"] if info else None,
+            "sha256": row["image_id"],
+            "metrics": row,
+        })
+    return {"case_id": case_id, "visits": len(entries), "entries": entries}
@@ -0,0 +1,309 @@
+"""
+CPU-only triage model: a draft fill-in with per-field confidence, without a network call.
+
+Images are reduced to the similarity index descriptor (similarity_index.describe_image:
+colour + texture histograms, unit length), and every fill-in field is predicted by a
+similarity-weighted vote of the k most similar labelled images. A field's confidence
+is the weight share behind the predicted value (for numeric fields: the share of
+neighbours within NUMERIC_TOLERANCE of the weighted median), shrunk by the effective
+number of neighbours that voted. The labels are Gemini fill-ins from batch_fillin.py,
+so the model learns to agree with Gemini, and `eval` measures exactly that
+(leave-one-out, or against a separate labels file).
+
+    python batch_fillin.py ../ai_engine/data --out fillin_results.ndjson
+    python triage_model.py train fillin_results.ndjson --images ../ai_engine/data
+    python triage_model.py eval fillin_results.ndjson --images ../ai_engine/data --threshold 0.8
+    python triage_model.py predict some_wound.jpg
+"""
+import io
+import os
+import sys
+import json
+import time
+import typing
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+from pydantic import ValidationError
+
+from schemas import FillIn, repair_fillin
+from similarity_index import describe_image
+from image_preprocess import UnsupportedImageError
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "triage_model.npz")
+DEFAULT_K = 15
+TEMPERATURE = 0.05   # softmax over cosine similarity; smaller = nearer neighbours count more
+PRIOR_NEIGHBOURS = 1.0   # confidence shrinkage: a vote carried by one or two neighbours is not a sure thing
+
+NUMERIC_TOLERANCE = {
+    "size_width_cm": 1.0, "size_length_cm": 1.0,
+    "bed_slough_pct": 10, "bed_necrotic_pct": 10,
+    "pain_score": 2,
+}
+# the enum / yes-no fields: auto mode only skips Gemini when all of these are confident
+GATING_FIELDS = [
+    name for name, field in FillIn.model_fields.items()
+    if typing.get_origin(field.annotation) is typing.Literal or field.annotation is bool
+]
+
+
+#---------- MODEL ---------------#
+class TriageModel:
+    def __init__(self, image_ids, features, labels, k=DEFAULT_K):
+        self.image_ids = list(image_ids)
+        self.features = np.asarray(features, dtype=np.float32).reshape(len(self.image_ids), -1)
+        self.labels = {field: list(values) for field, values in labels.items()}   # field -> value per image
+        self.k = k
+        self._numeric = {
+            field: np.array([np.nan if v is None else float(v) for v in self.labels[field]])
+            for field in NUMERIC_TOLERANCE if field in self.labels
+        }
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    #---------- PERSISTENCE ---------------#
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            meta = json.loads(str(f["meta"]))
+            return cls(meta["image_ids"], f["features"], meta["labels"], k=meta["k"])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        meta = json.dumps({"image_ids": self.image_ids, "labels": self.labels, "k": self.k}, ensure_ascii=False)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_path, features=self.features, meta=np.array(meta))
+        os.replace(tmp_path, path)
+
+    #---------- PREDICTION ---------------#
+    def predict(self, features, exclude_id=None):
+        """(fields, confidence) for one descriptor; `exclude_id` leaves that image out (evaluation)."""
+        scores = self.features @ features
+        if exclude_id is not None:
+            scores = np.where(np.array([i == exclude_id for i in self.image_ids]), -np.inf, scores)
+        k = min(self.k, int(np.isfinite(scores).sum()))
+        if k == 0:
+            return {}, {}
+        top = np.argpartition(-scores, k - 1)[:k]
+        weights = np.exp((scores[top] - scores[top].max()) / TEMPERATURE)
+        weights /= weights.sum()
+        effective = 1.0 / float(np.sum(weights ** 2))
+        shrink = effective / (effective + PRIOR_NEIGHBOURS)
+
+        fields, confidence = {}, {}
+        for field, values in self.labels.items():
+            if field in self._numeric:
+                fields[field], share = self._vote_numeric(self._numeric[field][top], weights, field)
+            else:
+                fields[field], share = self._vote([values[i] for i in top], weights)
+            confidence[field] = round(share * shrink, 3)
+        return fields, confidence
+
+    @staticmethod
+    def _vote(values, weights):
+        totals = {}
+        for value, weight in zip(values, weights):
+            key = json.dumps(value)
+            totals[key] = totals.get(key, 0.0) + weight
+        key, share = max(totals.items(), key=lambda kv: kv[1])
+        return json.loads(key), float(share)
+
+    @staticmethod
+    def _vote_numeric(values, weights, field):
+        known = ~np.isnan(values)
+        if not known.any():
+            return None, 0.0
+        values, weights = values[known], weights[known] / weights[known].sum()
+        order = np.argsort(values)
+        cumulative = np.cumsum(weights[order])
+        median = float(values[order][np.searchsorted(cumulative, 0.5)])
+        share = float(weights[np.abs(values - median) <= NUMERIC_TOLERANCE[field]].sum())
+        value = int(round(median)) if FillIn.model_fields[field].annotation is int else round(median, 1)
+        return value, share
+
+    def predict_bytes(self, data):
+        """Draft fill-in for an uploaded image: {"fields": {...}, "confidence": {...}}."""
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                _, features = describe_image(img)
+        except Exception as e:
+            raise UnsupportedImageError(f"cannot decode image: {e}") from e
+        fields, confidence = self.predict(features)
+        return {"fields": fields, "confidence": confidence}
+
+    @staticmethod
+    def confident(confidence, threshold, fields=GATING_FIELDS):
+        return all(confidence.get(field, 0.0) >= threshold for field in fields)
+
+
+#---------- TRAINING DATA ---------------#
+def load_labels(ndjson_path):
+    """{image path: fields} from batch_fillin.py output; last success line per image, validated against FillIn."""
+    labels, skipped = {}, 0
+    with open(ndjson_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            if row.get("status") != "success":
+                continue
+            fields = row.get("analysis")
+            if isinstance(fields, str):
+                fields = json.loads(fields)
+            try:
+                labels[row["image"]] = FillIn.model_validate(repair_fillin(fields)).model_dump(mode="json")
+            except (ValidationError, TypeError, AttributeError):
+                skipped += 1
+    if skipped:
+        print(f"skipped {skipped} labels that fail the fill-in schema")
+    return labels
+
+
+def _describe_file(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as img:
+        return hashlib.sha256(data).hexdigest(), describe_image(img)[1]
+
+
+def build_dataset(labels, images_root):
+    """(image ids, features, labels by field) for the labelled images found under images_root; one entry per distinct image."""
+    paths = [p for p in sorted(labels) if os.path.exists(os.path.join(images_root, p))]
+    missing = len(labels) - len(paths)
+    if missing:
+        print(f"{missing} labelled images not found under {images_root}")
+    ids, features, rows = [], [], []
+    seen = set()
+    with ProcessPoolExecutor() as executor:
+        described = executor.map(_describe_file, [os.path.join(images_root, p) for p in paths], chunksize=16)
+        for path, (image_id, vector) in zip(paths, described):
+            if image_id in seen:
+                continue   # identical upload under another name: it would only vote for itself
+            seen.add(image_id)
+            ids.append(image_id)
+            features.append(vector)
+            rows.append(labels[path])
+    by_field = {field: [row.get(field) for row in rows] for field in FillIn.model_fields}
+    return ids, np.array(features, dtype=np.float32), by_field
+
+
+#---------- EVALUATION ---------------#
+def agrees(field, predicted, label):
+    if field in NUMERIC_TOLERANCE:
+        return predicted is not None and label is not None and abs(predicted - label) <= NUMERIC_TOLERANCE[field]
+    return predicted == label
+
+
+def evaluate(model, ids, features, labels, threshold, leave_one_out):
+    """Per-field agreement with the labels, overall and for predictions at or above `threshold`."""
+    per_field = {field: {"agree": 0, "confident": 0, "confident_agree": 0} for field in labels}
+    local, local_agree = 0, 0
+    for i, image_id in enumerate(ids):
+        fields, confidence = model.predict(features[i], exclude_id=image_id if leave_one_out else None)
+        for field, stats in per_field.items():
+            ok = agrees(field, fields.get(field), labels[field][i])
+            stats["agree"] += ok
+            if confidence.get(field, 0.0) >= threshold:
+                stats["confident"] += 1
+                stats["confident_agree"] += ok
+        if TriageModel.confident(confidence, threshold):
+            local += 1
+            local_agree += all(agrees(f, fields.get(f), labels[f][i]) for f in GATING_FIELDS)
+
+    n = len(ids)
+    report = {"images": n, "threshold": threshold, "fields": {}}
+    for field, stats in per_field.items():
+        values = [json.dumps(v) for v in labels[field]]
+        majority = max(values.count(v) for v in set(values)) / n if field not in NUMERIC_TOLERANCE else None
+        report["fields"][field] = {
+            "agreement": round(stats["agree"] / n, 3),
+            "majority_baseline": round(majority, 3) if majority is not None else None,
+            "coverage_at_threshold": round(stats["confident"] / n, 3),
+            "agreement_at_threshold": round(stats["confident_agree"] / stats["confident"], 3) if stats["confident"] else None,
+        }
+    report["auto_mode"] = {
+        "answered_locally": round(local / n, 3),
+        "gating_fields_all_agree": round(local_agree / local, 3) if local else None,
+    }
+    return report
+
+
+def print_report(report):
+    def fmt(value, spec=".3f"):
+        return "-" if value is None else format(value, spec)
+
+    print(f"{report['images']} images, threshold {report['threshold']}")
+    print(f"{'field':<20} {'agree':>6} {'major.':>6} {'cover':>6} {'agree@t':>8}")
+    for field, r in report["fields"].items():
+        print(f"{field:<20} {fmt(r['agreement']):>6} {fmt(r['majority_baseline']):>6} "
+              f"{fmt(r['coverage_at_threshold']):>6} {fmt(r['agreement_at_threshold']):>8}")
+    auto = report["auto_mode"]
+    print(f"auto mode: {fmt(auto['answered_locally'], '.1%')} answered locally, "
+          f"all gating fields agree on {fmt(auto['gating_fields_all_agree'], '.1%')} of those")
+
+
+def bench(model, images_root, paths, n=100):
+    """End-to-end predict_bytes latency (decode + describe + vote)."""
+    timings = []
+    for path in paths[:n]:
+        with open(os.path.join(images_root, path), "rb") as f:
+            data = f.read()
+        started = time.perf_counter()
+        model.predict_bytes(data)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings = np.array(timings)
+    print(f"predict_bytes over {len(timings)} images: p50 {np.percentile(timings, 50):.1f} ms, "
+          f"p95 {np.percentile(timings, 95):.1f} ms, max {timings.max():.1f} ms")
+
+
+#---------- CLI ---------------#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CPU triage model for fill-in pre-population")
+    parser.add_argument("command", choices=["train", "eval", "predict"])
+    parser.add_argument("path", help="batch_fillin.py NDJSON labels (train / eval) or an image (predict)")
+    parser.add_argument("--images", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_engine", "data"),
+                        help="root the labelled image paths are relative to")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("-k", type=int, default=DEFAULT_K)
+    parser.add_argument("--threshold", type=float, default=0.8, help="confidence needed to skip Gemini (auto mode)")
+    parser.add_argument("--holdout", action="store_true",
+                        help="eval: score the trained --model on these labels instead of leave-one-out on them")
+    parser.add_argument("--out", help="eval: also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.command == "predict":
+        model = TriageModel.load(args.model)
+        with open(args.path, "rb") as f:
+            draft = model.predict_bytes(f.read())
+        for field, value in draft["fields"].items():
+            print(f"{draft['confidence'][field]:.2f}  {field:<20} {value}")
+        return
+
+    labels = load_labels(args.path)
+    started = time.perf_counter()
+    ids, features, by_field = build_dataset(labels, args.images)
+    print(f"described {len(ids)} labelled images in {time.perf_counter() - started:.1f}s")
+
+    if args.command == "train":
+        model = TriageModel(ids, features, by_field, k=args.k)
+        model.save(args.model)
+        print(f"wrote {args.model} ({len(model)} images, k={model.k})")
+        return
+
+    model = TriageModel.load(args.model) if args.holdout else TriageModel(ids, features, by_field, k=args.k)
+    report = evaluate(model, ids, features, by_field, args.threshold, leave_one_out=not args.holdout)
+    report["mode"] = "holdout" if args.holdout else "leave-one-out"
+    print_report(report)
+    bench(model, args.images, sorted(p for p in labels if os.path.exists(os.path.join(args.images, p))))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())